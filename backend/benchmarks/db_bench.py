@@ -0,0 +1,96 @@
+import os
+import time
+import tempfile
+import argparse
+import threading
+from flaskapp import create_app, db
+from flaskapp.config import Config
+
+# login and sign up throughput under concurrency, with and without the database presets
+#   cd backend && python -m benchmarks.db_bench --threads 8 --users 200
+# bcrypt runs inline at the lowest cost and redis is replaced by the memory backend,
+# so the numbers are dominated by the database
+
+
+class BenchConfig(Config):
+	STATE_BACKEND = 'memory'
+	RATELIMIT_ENABLED = False
+	HASH_WORKERS = 0
+	BCRYPT_LOG_ROUNDS = 4
+	HASH_TIME_BUDGET_MS = None
+	MAIL_SUPPRESS_SEND = True
+	USER_CACHE_ENABLED = False
+
+
+def make_app(uri, presets):
+	config = type('Config', (BenchConfig,), {'SQLALCHEMY_DATABASE_URI': uri, 'DATABASE_PRESETS': presets})
+	app = create_app(config)
+	with app.app_context():
+		db.create_all()
+	return app
+
+
+def run_threads(app, threads, jobs, fn):
+	lock = threading.Lock()
+	jobs = list(jobs)
+	failures = []
+
+	def worker():
+		client = app.test_client()
+		while True:
+			with lock:
+				if not jobs:
+					return
+				job = jobs.pop()
+			status = fn(app, client, job)
+			if status != 200:
+				with lock:
+					failures.append(status)
+
+	workers = [threading.Thread(target=worker) for _ in range(threads)]
+	begin = time.perf_counter()
+	for w in workers:
+		w.start()
+	for w in workers:
+		w.join()
+	return time.perf_counter() - begin, failures
+
+
+def sign_up(app, client, i):
+	email = f'user{i}@example.com'
+	response = client.post('/api-v1/users/sign-up/', json={'name': f'user {i}', 'email': email})
+	if response.status_code != 200:
+		return response.status_code
+	otp = app.extensions['otp_store']._data[email][0]
+	payload = {'name': f'user {i}', 'email': email, 'password': 'Asdf1111', 'otp': otp}
+	return client.post('/api-v1/users/verify/', json=payload).status_code
+
+
+def log_in(app, client, i):
+	payload = {'email': f'user{i}@example.com', 'password': 'Asdf1111'}
+	return client.post('/api-v1/users/log-in/', json=payload).status_code
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--threads', type=int, default=8)
+	parser.add_argument('--users', type=int, default=200)
+	args = parser.parse_args()
+
+	for presets in (False, True):
+		with tempfile.TemporaryDirectory() as tmp:
+			app = make_app(f"sqlite:///{os.path.join(tmp, 'bench.db')}", presets)
+			label = 'presets' if presets else 'defaults'
+
+			elapsed, failures = run_threads(app, args.threads, range(args.users), sign_up)
+			print(f'{label:<9} sign up {args.users / elapsed:8.1f} req/s  failures {len(failures)}')
+
+			elapsed, failures = run_threads(app, args.threads, list(range(args.users)) * 3, log_in)
+			print(f'{label:<9} log in  {args.users * 3 / elapsed:8.1f} req/s  failures {len(failures)}')
+
+			with app.app_context():
+				db.engine.dispose()
+
+
+if __name__ == '__main__':
+	main()
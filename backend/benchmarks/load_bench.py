@@ -0,0 +1,179 @@
+import os
+import re
+import sys
+import time
+import tempfile
+import argparse
+import threading
+import fakeredis
+from unittest import mock
+from flaskapp import create_app, db
+from flaskapp.state import RedisClient
+from flaskapp.users import outbox
+from benchmarks.db_bench import BenchConfig
+from benchmarks.sinks import SMTPSink
+from benchmarks.report import summarize, write_report, load_report, compare, print_comparison
+
+# every users_bp and main_bp route driven by concurrent clients, all in one process
+#   cd backend && python -m benchmarks.load_bench --users 200 --clients 8 --output load.json
+#   python -m benchmarks.load_bench --compare load.json --threshold 0.2
+# redis is fakeredis (lua scripts included), mail goes through the outbox worker to a local smtp sink
+# that keeps the messages, the otps for verify and new-password are read from there.
+# The routes run in the order of a user's life, each one gets one request per user.
+
+OTP_REGEX = re.compile(rb'OTP: (\d+)')
+PASSWORD = 'Asdf1111'
+NEW_PASSWORD = 'Qwer2222'
+
+
+class LoadConfig(BenchConfig):
+	STATE_BACKEND = 'redis'
+	USER_CACHE_ENABLED = True
+	MAIL_SUPPRESS_SEND = False
+
+
+def make_app(uri, sink):
+	server = fakeredis.FakeServer()
+	config = type('Config', (LoadConfig,), {'SQLALCHEMY_DATABASE_URI': uri, **sink.config()})
+
+	# every redis_client of this app talks to the same in-memory server
+	with mock.patch.object(RedisClient, '_create', lambda self, app: fakeredis.FakeRedis(server=server, decode_responses=True)):
+		app = create_app(config)
+	with app.app_context():
+		db.create_all()
+	return app
+
+
+def start_outbox(app):
+	stop = threading.Event()
+
+	def run():
+		with app.app_context():
+			outbox.run_worker('load-bench', stop)
+
+	thread = threading.Thread(target=run, daemon=True)
+	thread.start()
+	return stop, thread
+
+
+# ===============================================
+# send the jobs from client threads, a job is the kwargs of one test client request
+def drive(app, jobs, clients, expect=200, keep=False):
+	lock = threading.Lock()
+	pending = list(enumerate(jobs))
+	latencies, bodies = [], {}
+	errors = 0
+
+	def client_thread():
+		nonlocal errors
+		client = app.test_client()
+		while True:
+			with lock:
+				if not pending:
+					return
+				index, job = pending.pop()
+			begin = time.perf_counter()
+			response = client.open(**job)
+			elapsed = time.perf_counter() - begin
+			with lock:
+				latencies.append(elapsed)
+				if response.status_code != expect:
+					errors += 1
+				elif keep:
+					bodies[index] = response.get_json()
+
+	threads = [threading.Thread(target=client_thread) for _ in range(clients)]
+	begin = time.perf_counter()
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	return summarize(latencies, time.perf_counter() - begin, errors), bodies
+
+
+def post(path, **data):
+	return {'path': path, 'method': 'POST', 'json': data}
+
+
+def get(path, **kwargs):
+	return {'path': path, 'method': 'GET', **kwargs}
+
+
+def read_otps(sink, users, expected, timeout):
+	if not sink.wait_for(expected, timeout):
+		sys.exit(f'only {sink.messages} of {expected} emails arrived within {timeout}s')
+	return {user['email']: OTP_REGEX.search(sink.inbox[user['email']][-1]).group(1).decode() for user in users}
+
+
+def run(app, sink, users, clients, timeout):
+	results = {}
+
+	def phase(endpoint, jobs, keep=False):
+		results[endpoint], bodies = drive(app, jobs, clients, keep=keep)
+		print(f"{endpoint:<28} {results[endpoint]['rps']:9.1f} req/s   p50 {results[endpoint]['p50_ms']:8.2f} ms   "
+			f"p95 {results[endpoint]['p95_ms']:8.2f} ms   p99 {results[endpoint]['p99_ms']:8.2f} ms   errors {results[endpoint]['errors']}")
+		return bodies
+
+	prefix = '/api-v1/users'
+	phase('main.home', [get('/api-v1/main/home/') for _ in users])
+	phase('users.availability', [get(f"{prefix}/availability/", query_string={'name': u['name'], 'email': u['email']}) for u in users])
+
+	phase('users.sign_up', [post(f'{prefix}/sign-up/', name=u['name'], email=u['email']) for u in users])
+	otps = read_otps(sink, users, len(users), timeout)
+	phase('users.verify', [post(f'{prefix}/verify/', otp=otps[u['email']], name=u['name'], email=u['email'], password=PASSWORD) for u in users])
+
+	bodies = phase('users.log_in', [post(f'{prefix}/log-in/', email=u['email'], password=PASSWORD) for u in users], keep=True)
+	tokens = [body['token'] for body in bodies.values()]
+	phase('users.refresh', [post(f'{prefix}/refresh/', refresh_token=body['refresh_token']) for body in bodies.values()])
+	phase('users.account', [get(f'{prefix}/account/', headers={'Authorization': f"{app.config['AUTH_PREFIX']} {t}"}) for t in tokens])
+	phase('users.log_out', [
+		{**post(f'{prefix}/log-out/'), 'headers': {'Authorization': f"{app.config['AUTH_PREFIX']} {t}"}} for t in tokens
+	])
+
+	phase('users.reset_password', [post(f'{prefix}/reset-password/', email=u['email']) for u in users])
+	otps = read_otps(sink, users, 2 * len(users), timeout)
+	phase('users.verify_reset_otp', [post(f'{prefix}/verify-reset-otp/', email=u['email'], otp=otps[u['email']]) for u in users])
+	phase('users.new_pass', [post(f'{prefix}/new-password/', email=u['email'], otp=otps[u['email']], password=NEW_PASSWORD) for u in users])
+
+	# a new route without a phase shows up here instead of silently missing from the report
+	routes = {rule.endpoint for rule in app.url_map.iter_rules() if rule.endpoint.split('.')[0] in ('users', 'main')}
+	for endpoint in sorted(routes - set(results)):
+		print(f'{endpoint:<28} not benchmarked, add a phase to load_bench.py')
+	return results
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--users', type=int, default=200, help='requests per route')
+	parser.add_argument('--clients', type=int, default=8, help='concurrent client threads')
+	parser.add_argument('--smtp-port', type=int, default=8025)
+	parser.add_argument('--mail-timeout', type=float, default=60, help='seconds to wait for the otp emails')
+	parser.add_argument('--output', help='write the results to this json file')
+	parser.add_argument('--compare', help='json file of an earlier run, exit 1 if a route got slower')
+	parser.add_argument('--metric', default='p95_ms', choices=['mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'])
+	parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative slowdown, 0.2 = 20%%')
+	args = parser.parse_args()
+
+	users = [{'name': f'load user {i}', 'email': f'load{i}@example.com'} for i in range(args.users)]
+
+	with tempfile.TemporaryDirectory() as tmp, SMTPSink(port=args.smtp_port, capture=True) as sink:
+		app = make_app(f"sqlite:///{os.path.join(tmp, 'load.db')}", sink)
+		stop, worker = start_outbox(app)
+		try:
+			results = run(app, sink, users, args.clients, args.mail_timeout)
+		finally:
+			stop.set()
+			worker.join()
+
+	settings = {'users': args.users, 'clients': args.clients}
+	report = write_report(args.output, 'load_bench', settings, results) if args.output else {'results': results}
+
+	if args.compare:
+		rows, regressions = compare(load_report(args.compare), report, args.metric, args.threshold)
+		print_comparison(rows, args.metric, args.threshold)
+		if regressions:
+			sys.exit(f"{len(regressions)} routes slower than the baseline by more than {args.threshold:.0%}: {', '.join(regressions)}")
+
+
+if __name__ == '__main__':
+	main()
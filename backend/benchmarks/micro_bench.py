@@ -0,0 +1,150 @@
+import os
+import sys
+import timeit
+import argparse
+import tempfile
+import statistics
+from flask import request
+from contextlib import nullcontext
+from flaskapp import create_app, db, hasher, user_cache, keyring, revocation
+from flaskapp.db_models import User
+from flaskapp.users.utils import generate_otp, create_access_token
+from flaskapp.utils import login_required, logout_required, validate_request_json
+from benchmarks.db_bench import BenchConfig
+from benchmarks.report import write_report, load_report, compare, print_comparison
+
+# per call cost of the auth hot paths, each one alone and in its own request context
+#   cd backend && python -m benchmarks.micro_bench --output micro.json
+#   python -m benchmarks.micro_bench --compare micro.json --threshold 0.1
+# every case is warmed up, then timed --repeat times over --number calls, the median of the
+# repeats is the number to compare, min and stdev show how noisy the machine was.
+# The validation rules are read from the registered views, so they are the ones the routes use.
+
+# valid values for every field the routes validate
+VALID_FIELDS = {
+	'name': 'bench user',
+	'email': 'bench@example.com',
+	'otp': '123456',
+	'password': 'Asdf1111',
+	'refresh_token': 'r' * 43,
+}
+
+
+def make_app(uri, jwt_keys):
+	config = type('Config', (BenchConfig,), {'SQLALCHEMY_DATABASE_URI': uri, 'USER_CACHE_ENABLED': True, 'JWT_KEYS': jwt_keys})
+	app = create_app(config)
+	with app.app_context():
+		db.create_all()
+		user = User(username='bench user', email='bench@example.com', password=hasher.generate_password_hash('Asdf1111'))
+		db.session.add(user)
+		db.session.commit()
+		user_id = user.id
+	return app, user_id
+
+
+def endpoint(*args, **kwargs):
+	return kwargs
+
+
+# ===============================================
+# name -> (context factory, callable), the callable runs inside the context
+def build_cases(app, user_id):
+	prefix = app.config['AUTH_PREFIX']
+	with app.app_context():
+		token = create_access_token(user_id)
+	claims = keyring.decode(token)
+	header = f'{prefix} {token}'
+	authorized = lambda: app.test_request_context(headers={'Authorization': header})
+
+	protected = login_required(endpoint)
+	public = logout_required(endpoint)
+
+	# the header parsing of login_required
+	def header_token():
+		auth_header = request.headers.get('Authorization')
+		if auth_header and auth_header.startswith(prefix):
+			return auth_header.split(' ')[1]
+
+	def login_required_db():
+		user_cache.enabled = False
+		try:
+			return protected()
+		finally:
+			user_cache.enabled = True
+
+	cases = {
+		'login_required.header': (authorized, header_token),
+		'login_required.jwt_decode': (nullcontext, lambda: keyring.decode(token)),
+		'login_required.revocation': (app.app_context, lambda: revocation.is_revoked(claims)),
+		'login_required.user_cached': (authorized, lambda: user_cache.get(user_id)),
+		'login_required': (authorized, protected),
+		'login_required.uncached': (authorized, login_required_db),
+		'logout_required': (app.test_request_context, public),
+		'generate_otp': (nullcontext, generate_otp),
+		'log_in.jwt_encode': (app.app_context, lambda: create_access_token(user_id)),
+	}
+
+	# validate_request_json with the rules and a valid body of every route that has them
+	for name, view in sorted(app.view_functions.items()):
+		rules = getattr(view, 'json_rules', None)
+		if rules is None:
+			continue
+		body = {field: VALID_FIELDS[field] for field in rules}
+		context = lambda body=body: app.test_request_context(method='POST', json=body)
+		cases[f'validate.{name}'] = (context, validate_request_json(rules)(endpoint))
+	return cases
+
+
+def measure(fn, number, repeat, warmup):
+	for _ in range(warmup):
+		fn()
+	# per call microseconds of each repeat
+	runs = [seconds / number * 1e6 for seconds in timeit.Timer(fn).repeat(repeat=repeat, number=number)]
+	return {
+		'median_us': round(statistics.median(runs), 3),
+		'mean_us': round(statistics.fmean(runs), 3),
+		'min_us': round(min(runs), 3),
+		'stdev_us': round(statistics.stdev(runs), 3) if len(runs) > 1 else 0.0,
+		'number': number,
+		'repeat': repeat,
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--number', type=int, default=2000, help='calls per repeat')
+	parser.add_argument('--repeat', type=int, default=7)
+	parser.add_argument('--warmup', type=int, default=200)
+	parser.add_argument('--only', help='run the cases whose name starts with this')
+	parser.add_argument('--jwt-key', action='append', default=[], help='pem file signing the tokens instead of SECRET_KEY, see JWT_KEYS')
+	parser.add_argument('--output', help='write the results to this json file')
+	parser.add_argument('--compare', help='json file of an earlier run, exit 1 if a case got slower')
+	parser.add_argument('--threshold', type=float, default=0.1, help='allowed relative slowdown of the median, 0.1 = 10%%')
+	args = parser.parse_args()
+
+	results = {}
+	with tempfile.TemporaryDirectory() as tmp:
+		app, user_id = make_app(f"sqlite:///{os.path.join(tmp, 'micro.db')}", args.jwt_key)
+		for name, (context, fn) in build_cases(app, user_id).items():
+			if args.only and not name.startswith(args.only):
+				continue
+			# the user loads need an app context, the context of the case is pushed inside it
+			with app.app_context(), context():
+				results[name] = measure(fn, args.number, args.repeat, args.warmup)
+			r = results[name]
+			print(f"{name:<36} median {r['median_us']:9.2f} us   min {r['min_us']:9.2f} us   stdev {r['stdev_us']:7.2f} us")
+		with app.app_context():
+			db.engine.dispose()
+
+	settings = {'number': args.number, 'repeat': args.repeat, 'warmup': args.warmup, 'jwt_algorithm': keyring.signing[1] if keyring.signing else 'HS256'}
+	report = write_report(args.output, 'micro_bench', settings, results) if args.output else {'results': results}
+
+	if args.compare:
+		rows, regressions = compare(load_report(args.compare), report, 'median_us', args.threshold)
+		print_comparison(rows, 'median_us', args.threshold)
+		if regressions:
+			sys.exit(f"{len(regressions)} hot paths slower than the baseline by more than {args.threshold:.0%}: {', '.join(regressions)}")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,80 @@
+import json
+import platform
+import datetime
+import statistics
+import subprocess
+
+
+# ===============================================
+# json reports shared by the benchmarks, one file per run
+#   {"benchmark": ..., "created": ..., "commit": ..., "python": ..., "settings": {...}, "results": {name: {metric: value}}}
+# two reports of the same benchmark are compared with compare()
+
+
+def percentile(ordered, q):
+	if not ordered:
+		return 0.0
+	return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+# latencies in seconds, the summary in milliseconds
+def summarize(latencies, seconds, errors):
+	ordered = sorted(latencies)
+	return {
+		'requests': len(ordered),
+		'errors': errors,
+		'rps': round(len(ordered) / seconds, 1) if seconds else 0.0,
+		'mean_ms': round(statistics.fmean(ordered) * 1000, 3) if ordered else 0.0,
+		'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+		'p95_ms': round(percentile(ordered, 0.95) * 1000, 3),
+		'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+	}
+
+
+def git_commit():
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def write_report(path, benchmark, settings, results):
+	report = {
+		'benchmark': benchmark,
+		'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+		'commit': git_commit(),
+		'python': platform.python_version(),
+		'settings': settings,
+		'results': results,
+	}
+	with open(path, 'w') as f:
+		json.dump(report, f, indent=2, sort_keys=True)
+	return report
+
+
+def load_report(path):
+	with open(path) as f:
+		return json.load(f)
+
+
+# relative change of metric (higher is worse) for the names in both reports,
+# returns [(name, before, after, change)] and the names whose change is above threshold
+def compare(baseline, current, metric, threshold):
+	rows, regressions = [], []
+	for name, result in current['results'].items():
+		before = baseline['results'].get(name, {}).get(metric)
+		after = result.get(metric)
+		if not before or after is None:
+			continue
+		change = (after - before) / before
+		rows.append((name, before, after, change))
+		if change > threshold:
+			regressions.append(name)
+	return rows, regressions
+
+
+def print_comparison(rows, metric, threshold):
+	print(f'{"":<36} {"before " + metric:>16} {"after":>12} {"change":>8}')
+	for name, before, after, change in rows:
+		flag = '  REGRESSION' if change > threshold else ''
+		print(f'{name:<36} {before:16.3f} {after:12.3f} {change:+8.1%}{flag}')
@@ -0,0 +1,69 @@
+import time
+import asyncio
+import threading
+from collections import defaultdict
+from aiosmtpd.controller import Controller
+
+
+# local smtp server that accepts every message and keeps count
+# connect_delay stands in for the tls handshake and auth round trips of a real server
+# capture keeps the raw messages per recipient in inbox, see wait_for
+class SMTPSink():
+	def __init__(self, host='127.0.0.1', port=8025, connect_delay=0.0, delay=0.0, capture=False):
+		self.host = host
+		self.port = port
+		self.connect_delay = connect_delay
+		self.delay = delay
+		self.capture = capture
+		self.messages = 0
+		self.sessions = 0
+		self.inbox = defaultdict(list)
+		self._received = threading.Condition()
+		self._controller = Controller(self, hostname=host, port=port)
+
+	async def handle_EHLO(self, server, session, envelope, hostname, responses):
+		self.sessions += 1
+		if self.connect_delay:
+			await asyncio.sleep(self.connect_delay)
+		session.host_name = hostname
+		return responses
+
+	async def handle_DATA(self, server, session, envelope):
+		if self.delay:
+			await asyncio.sleep(self.delay)
+		with self._received:
+			self.messages += 1
+			if self.capture:
+				for rcpt in envelope.rcpt_tos:
+					self.inbox[rcpt].append(envelope.content)
+			self._received.notify_all()
+		return '250 OK'
+
+	# block until count messages arrived in total, False on timeout
+	def wait_for(self, count, timeout=30):
+		end = time.monotonic() + timeout
+		with self._received:
+			while self.messages < count:
+				left = end - time.monotonic()
+				if left <= 0:
+					return False
+				self._received.wait(left)
+		return True
+
+	def __enter__(self):
+		self._controller.start()
+		return self
+
+	def __exit__(self, *exc):
+		self._controller.stop()
+
+	# mail settings pointing the app at this sink
+	def config(self):
+		return {
+			'MAIL_SERVER': self.host,
+			'MAIL_PORT': self.port,
+			'MAIL_USE_SSL': False,
+			'MAIL_USE_TLS': False,
+			'MAIL_USERNAME': None,
+			'MAIL_PASSWORD': None,
+		}
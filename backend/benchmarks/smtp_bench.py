@@ -0,0 +1,54 @@
+import time
+import argparse
+from flaskapp import create_app, mail
+from flaskapp.config import Config
+from flaskapp.users.messages import otp_message, SMTPPool
+from benchmarks.sinks import SMTPSink
+
+# compare per-message Flask-Mail connections with the pooled transport
+#   cd backend && python -m benchmarks.smtp_bench --messages 200 --connect-delay 0.05
+
+
+def run(label, fn, messages):
+	begin = time.perf_counter()
+	fn(messages)
+	elapsed = time.perf_counter() - begin
+	print(f'{label:<22} {len(messages) / elapsed:10.1f} msg/s {elapsed / len(messages) * 1000:8.2f} ms/msg')
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--messages', type=int, default=200)
+	parser.add_argument('--batch', type=int, default=20)
+	parser.add_argument('--connect-delay', type=float, default=0.05, help='seconds added to every new smtp session')
+	args = parser.parse_args()
+
+	with SMTPSink(connect_delay=args.connect_delay) as sink:
+		class BenchConfig(Config):
+			pass
+		for key, value in sink.config().items():
+			setattr(BenchConfig, key, value)
+
+		app = create_app(BenchConfig)
+		messages = [otp_message(f'{i:06}', f'user{i}@example.com') for i in range(args.messages)]
+
+		with app.app_context():
+			run('flask-mail send', lambda msgs: [mail.send(m) for m in msgs], messages)
+
+			pool = SMTPPool()
+			run('pooled send', lambda msgs: [pool.send(m) for m in msgs], messages)
+			print('  ', pool.stats())
+
+			pool = SMTPPool()
+			def batched(msgs):
+				for i in range(0, len(msgs), args.batch):
+					pool.send_many(msgs[i:i + args.batch])
+			run(f'pooled batch of {args.batch}', batched, messages)
+			print('  ', pool.stats())
+			pool.close()
+
+		print(f'sink received {sink.messages} messages over {sink.sessions} sessions')
+
+
+if __name__ == '__main__':
+	main()
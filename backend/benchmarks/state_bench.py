@@ -0,0 +1,51 @@
+import time
+import redis
+import argparse
+import statistics
+from flaskapp.config import Config
+from flaskapp.users.otp_store import RedisOTPStore, MemoryOTPStore
+
+# latency of the otp operations for each state backend
+#   cd backend && python -m benchmarks.state_bench --redis-url redis://localhost:6379/15
+
+
+def measure(fn, rounds):
+	samples = []
+	for i in range(rounds):
+		begin = time.perf_counter()
+		fn(i)
+		samples.append((time.perf_counter() - begin) * 1e6)
+	samples.sort()
+	return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def bench(label, store, rounds):
+	ops = {
+		'issue': lambda i: store.issue(f'user{i}@example.com', '123456', 120),
+		'verify': lambda i: store.verify(f'user{i}@example.com', '123456'),
+		'consume': lambda i: store.consume(f'user{i}@example.com', '123456'),
+	}
+	for name, fn in ops.items():
+		p50, p99 = measure(fn, rounds)
+		print(f'{label:<8} {name:<8} p50 {p50:9.1f} us   p99 {p99:9.1f} us')
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--rounds', type=int, default=5000)
+	parser.add_argument('--redis-url', default='redis://localhost:6379/15')
+	args = parser.parse_args()
+
+	bench('memory', MemoryOTPStore(args.rounds * 2, Config.OTP_MAX_ATTEMPTS), args.rounds)
+
+	client = redis.Redis.from_url(args.redis_url, decode_responses=True)
+	try:
+		client.ping()
+	except redis.ConnectionError:
+		print(f'redis   skipped, nothing listening on {args.redis_url}')
+		return
+	bench('redis', RedisOTPStore(client, Config.OTP_MAX_ATTEMPTS), args.rounds)
+
+
+if __name__ == '__main__':
+	main()
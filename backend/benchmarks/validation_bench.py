@@ -0,0 +1,110 @@
+import time
+import argparse
+import statistics
+from functools import wraps
+from flask import Flask, request, jsonify
+from flaskapp.utils import (
+	validate_request_json,
+	MAX_NAME_LENGTH, MIN_NAME_LENGTH,
+	MAX_EMAIL_LENGTH, MIN_EMAIL_LENGTH, EMAIL_REGEX,
+	OTP_LENGTH,
+	MIN_PASS_LENGTH, MAX_PASS_LENGTH, PASSWORD_REGEX
+)
+
+# per request cost of the compiled validator against the previous one, on the rules of /verify/
+# the body is parsed once per request context, so the numbers are the validation alone
+#   cd backend && python -m benchmarks.validation_bench
+
+RULES = {
+	'otp': {'required': True, 'min_len': OTP_LENGTH, 'max_len': OTP_LENGTH},
+	'name': {'required': True, 'min_len': MIN_NAME_LENGTH, 'max_len': MAX_NAME_LENGTH},
+	'email': {'required': True, 'min_len': MIN_EMAIL_LENGTH, 'max_len': MAX_EMAIL_LENGTH, 'regex': EMAIL_REGEX},
+	'password': {'required': True, 'min_len': MIN_PASS_LENGTH, 'max_len': MAX_PASS_LENGTH, 'regex': PASSWORD_REGEX}
+}
+
+BODIES = {
+	'valid': {'otp': '123456', 'name': 'test user 1', 'email': 'user@example.com', 'password': 'Asdf1111'},
+	'invalid': {'otp': '123456', 'name': 'test user 1', 'email': 'user@example.com', 'password': 'asdf'},
+}
+
+
+# the decorator before the rules were compiled, kept here as the baseline
+def legacy_validate_request_json(fields_to_validate):
+	def decorator(f):
+		@wraps(f)
+		def inner(*args, **kwargs):
+			response_data = request.get_json()
+			if not response_data:
+				return jsonify({'error': 'Request must be JSON.'}), 400
+
+			validated_stripped_data = {}
+			validation_errors = []
+			for field_name, rules in fields_to_validate.items():
+				value = response_data.get(field_name)
+				is_required = rules.get('required', False)
+				min_len = rules.get('min_len')
+				max_len = rules.get('max_len')
+				regex = rules.get('regex')
+
+				stripped_value = None
+				if value is not None:
+					stripped_value = str(value).strip()
+
+				if is_required and (stripped_value is None or stripped_value == ''):
+					validation_errors.append(f'{field_name.capitalize()} cannot be empty.')
+					continue
+
+				if stripped_value is not None and stripped_value != '':
+					if min_len is not None and len(stripped_value) < min_len:
+						validation_errors.append(f'{field_name.capitalize()} must be at least {min_len} characters.')
+						continue
+					if max_len is not None and len(stripped_value) > max_len:
+						validation_errors.append(f'{field_name.capitalize()} must be at most {max_len} characters.')
+						continue
+					if regex and not regex.fullmatch(stripped_value):
+						validation_errors.append(f'Invalid {field_name} format.')
+						continue
+
+				validated_stripped_data[f'{field_name}_stripped'] = stripped_value
+
+			if validation_errors:
+				return jsonify({'error': validation_errors[0]}), 400
+			return f(*args, **kwargs, **validated_stripped_data)
+		return inner
+	return decorator
+
+
+def measure(fn, rounds):
+	samples = []
+	for _ in range(rounds):
+		begin = time.perf_counter()
+		fn()
+		samples.append((time.perf_counter() - begin) * 1e6)
+	samples.sort()
+	return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--rounds', type=int, default=20000)
+	args = parser.parse_args()
+
+	app = Flask(__name__)
+	app.config['MAX_JSON_BYTES'] = 16 * 1024
+	route = lambda **kwargs: kwargs
+	validators = {
+		'legacy': legacy_validate_request_json(RULES)(route),
+		'compiled': validate_request_json(RULES)(route),
+		'collect': validate_request_json(RULES, collect_all=True)(route),
+	}
+
+	for body_name, body in BODIES.items():
+		with app.test_request_context(method='POST', json=body):
+			for label, fn in validators.items():
+				fn()
+				p50, p99 = measure(fn, args.rounds)
+				print(f'{body_name:<8} {label:<9} p50 {p50:7.2f} us   p99 {p99:7.2f} us')
+
+
+if __name__ == '__main__':
+	main()
@@ -1,26 +1,65 @@
-import redis
 from flask import Flask
 from flask_mail import Mail
 from flask_cors import CORS
-from flask_bcrypt import Bcrypt
 from flaskapp.config import Config
+from flaskapp import metrics, profiling
+from flaskapp.hashing import Hasher
+from flaskapp.keyring import Keyring, jwt_keygen_command
+from flaskapp.json_provider import FastJSONProvider
+from flaskapp.database import RoutingSession, apply_engine_presets, install_sqlite_pragmas, install_replicas, init_db_command
+from flaskapp.state import RedisClient
+from flaskapp.user_cache import UserCache
 from flask_sqlalchemy import SQLAlchemy
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 mail = Mail()
-db = SQLAlchemy()
-bcrypt = Bcrypt()
-redis_client = redis.StrictRedis(host='localhost', port=6379, decode_responses=True)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+hasher = Hasher()
+keyring = Keyring()
+redis_client = RedisClient()
+user_cache = UserCache(redis_client)
 
-def create_app():
+def create_app(config_class=Config):
 	app = Flask(__name__)
-	app.config.from_object(Config)
+	app.config.from_object(config_class)
+	app.json = FastJSONProvider(app)
 
+	# trust X-Forwarded-For from our own proxies so request.remote_addr is the client
+	if app.config['PROXY_COUNT']:
+		app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_COUNT'])
+
+	apply_engine_presets(app)
 	db.init_app(app)
+	with app.app_context():
+		install_sqlite_pragmas(app, db.engines.values())
+	install_replicas(app)
 	mail.init_app(app)
-	bcrypt.init_app(app)
+	hasher.init_app(app)
+	keyring.init_app(app)
+	redis_client.init_app(app)
+	user_cache.init_app(app)
+
+	with app.app_context():
+		engines = list(db.engines.values())
+	if 'db_replicas' in app.extensions:
+		engines += app.extensions['db_replicas'].engines
+	metrics.init_app(app, engines)
+	profiling.init_app(app)
+
+	from flaskapp import ratelimit, revocation
+	from flaskapp.users import otp_store, refresh_tokens, outbox, bloom
+	ratelimit.init_app(app)
+	revocation.init_app(app)
+	otp_store.init_app(app)
+	refresh_tokens.init_app(app)
+	outbox.init_app(app)
+	bloom.init_app(app)
 
 	from flaskapp.users.routes import users_bp
 	from flaskapp.main.routes import main_bp
+	import flaskapp.users.cli
+	app.cli.add_command(init_db_command)
+	app.cli.add_command(jwt_keygen_command)
 	app.register_blueprint(users_bp, url_prefix='/api-v1/users/')
 	app.register_blueprint(main_bp, url_prefix='/api-v1/main/')
 	
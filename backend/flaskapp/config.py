@@ -9,13 +9,103 @@ class Config():
 	AUTH_PREFIX = conf.get('AUTH_PREFIX')
 	SQLALCHEMY_DATABASE_URI = conf.get('SQLALCHEMY_DATABASE_URI')
 
+	# database engine tuning, presets per backend live in flaskapp/database.py
+	DATABASE_PRESETS = conf.get('DATABASE_PRESETS', True)
+	SQLALCHEMY_ENGINE_OPTIONS = conf.get('SQLALCHEMY_ENGINE_OPTIONS', {})	# pool_size, pool_recycle ... over the preset
+	SQLITE_PRAGMAS = conf.get('SQLITE_PRAGMAS', {})						# e.g. {"busy_timeout": 10000} over the defaults
+
+	# read replicas, SELECTs are spread over them and writes stay on SQLALCHEMY_DATABASE_URI
+	SQLALCHEMY_REPLICA_URIS = conf.get('SQLALCHEMY_REPLICA_URIS', [])
+	REPLICA_COOLDOWN = conf.get('REPLICA_COOLDOWN', 30)		# seconds an unreachable replica is skipped
+
 	# MAIL_SERVER configuration
-	MAIL_SERVER = 'smtp.gmail.com'
-	MAIL_PORT = 465
+	MAIL_SERVER = conf.get('MAIL_SERVER', 'smtp.gmail.com')
+	MAIL_PORT = conf.get('MAIL_PORT', 465)
 	MAIL_USERNAME = conf.get('EMAIL_USER') 	#email
 	MAIL_PASSWORD = conf.get('EMAIL_PASS')	#app password
-	MAIL_USE_TLS = False
-	MAIL_USE_SSL = True
+	MAIL_USE_TLS = conf.get('MAIL_USE_TLS', False)
+	MAIL_USE_SSL = conf.get('MAIL_USE_SSL', True)
+
+	# pooled smtp connections used by the outbox worker
+	SMTP_POOL_SIZE = conf.get('SMTP_POOL_SIZE', 2)			# idle connections kept open
+	SMTP_IDLE_TIMEOUT = conf.get('SMTP_IDLE_TIMEOUT', 240)	# seconds before an idle connection is dropped
+	SMTP_CHECK_AFTER = conf.get('SMTP_CHECK_AFTER', 30)		# seconds idle before a NOOP check on reuse
+
+	# email outbox, drained by worker.py
+	OUTBOX_BATCH_SIZE = conf.get('OUTBOX_BATCH_SIZE', 20)		# pending emails sent over one smtp session
+	OUTBOX_MAX_ATTEMPTS = conf.get('OUTBOX_MAX_ATTEMPTS', 5)
+	OUTBOX_BACKOFF = conf.get('OUTBOX_BACKOFF', 2)				# seconds before the first retry, doubled each time
+	OUTBOX_STATUS_TTL = conf.get('OUTBOX_STATUS_TTL', 86400)	# seconds the delivery status is kept
+
+	# ephemeral state (otps, outbox, caches), 'redis' or 'memory' for a single process deployment
+	STATE_BACKEND = conf.get('STATE_BACKEND', 'redis')
+	REDIS_URL = conf.get('REDIS_URL', 'redis://localhost:6379/0')
+	REDIS_MAX_CONNECTIONS = conf.get('REDIS_MAX_CONNECTIONS', 50)
+	MEMORY_STATE_MAX_KEYS = conf.get('MEMORY_STATE_MAX_KEYS', 100000)	# entries kept by the memory backend
+
+	# gunicorn.conf.py, workers and threads are sized from the cpu count and WEB_LOAD_TYPE unless set
+	WEB_BIND = conf.get('WEB_BIND', '127.0.0.1:8000')
+	WEB_WORKERS = conf.get('WEB_WORKERS')
+	WEB_THREADS = conf.get('WEB_THREADS')
+	WEB_LOAD_TYPE = conf.get('WEB_LOAD_TYPE', 'io')		# 'io' or 'cpu'
+
+	# seconds an otp stays valid and wrong guesses before it is dropped
+	OTP_TTL = conf.get('OTP_TTL', 120)
+	OTP_MAX_ATTEMPTS = conf.get('OTP_MAX_ATTEMPTS', 5)
+
+	# bloom filter behind the username / email availability endpoint
+	USER_BLOOM_CAPACITY = conf.get('USER_BLOOM_CAPACITY', 100000)		# expected users, twice the entries
+	USER_BLOOM_ERROR_RATE = conf.get('USER_BLOOM_ERROR_RATE', 0.01)
+
+	# rate limits, the per route limits are set on the routes
+	RATELIMIT_ENABLED = conf.get('RATELIMIT_ENABLED', True)
+	LOGIN_MAX_FAILURES = conf.get('LOGIN_MAX_FAILURES', 5)		# failed logins before the account is locked for that client ip
+	LOGIN_LOCK_SECONDS = conf.get('LOGIN_LOCK_SECONDS', 900)
+	PROXY_COUNT = conf.get('PROXY_COUNT', 0)					# reverse proxies in front of the app, 1 behind nginx
+
+	# password hashing pool
+	BCRYPT_LOG_ROUNDS = conf.get('BCRYPT_LOG_ROUNDS', 13)
+	HASH_TIME_BUDGET_MS = conf.get('HASH_TIME_BUDGET_MS')	# e.g. 250, calibrates the cost at startup
+	HASH_MAX_ROUNDS = conf.get('HASH_MAX_ROUNDS', 16)
+	HASH_WORKERS = conf.get('HASH_WORKERS', 2)				# bcrypt worker processes, 0 = hash inline
+	HASH_QUEUE_DEPTH = conf.get('HASH_QUEUE_DEPTH', 8)		# waiting hashes before answering 503
+	HASH_RETRY_AFTER = conf.get('HASH_RETRY_AFTER', 2)		# seconds sent in Retry-After
+
+	# authenticated user cache
+	USER_CACHE_ENABLED = conf.get('USER_CACHE_ENABLED', True)
+	USER_CACHE_SIZE = conf.get('USER_CACHE_SIZE', 1024)		# users kept per process
+	USER_CACHE_LOCAL_TTL = conf.get('USER_CACHE_LOCAL_TTL', 5)	# seconds in the process cache
+	USER_CACHE_TTL = conf.get('USER_CACHE_TTL', 300)			# seconds in redis
+
+	# rendered GET responses kept in redis, per route server_ttl in cache_response()
+	RESPONSE_CACHE_ENABLED = conf.get('RESPONSE_CACHE_ENABLED', False)
+
+	# prometheus metrics on /metrics, scraped with "Authorization: Bearer <METRICS_TOKEN>" when a token is set
+	METRICS_ENABLED = conf.get('METRICS_ENABLED', False)
+	METRICS_TOKEN = conf.get('METRICS_TOKEN')
+	METRICS_MULTIPROC_DIR = conf.get('METRICS_MULTIPROC_DIR')	# shared by the gunicorn workers, emptied at startup
+	METRICS_WORKER_PORT = conf.get('METRICS_WORKER_PORT', 9101)	# worker.py serves its metrics on 127.0.0.1:<port>, 0 = off
+
+	# cpu profiles of selected requests and tracemalloc snapshots on /debug/memory, see flaskapp/profiling.py
+	PROFILING_ENABLED = conf.get('PROFILING_ENABLED', False)
+	PROFILING_TOKEN = conf.get('PROFILING_TOKEN')				# "X-Profile: <token>" profiles one request, required for /debug/memory
+	PROFILING_SAMPLE_RATE = conf.get('PROFILING_SAMPLE_RATE', 0.0)	# share of all requests profiled, 0.001 = one in a thousand
+	PROFILING_DIR = conf.get('PROFILING_DIR', '/tmp/flaskapp-profiles')
+	PROFILING_KEEP = conf.get('PROFILING_KEEP', 100)			# newest pstats files kept (at least 1), older ones are removed
+	TRACEMALLOC_FRAMES = conf.get('TRACEMALLOC_FRAMES', 1)		# frames stored per allocation, more is slower
+
+	# request and response json
+	MAX_JSON_BYTES = conf.get('MAX_JSON_BYTES', 16 * 1024)	# larger json bodies are refused with 413
+	JSON_BACKEND = conf.get('JSON_BACKEND', 'auto')			# 'auto' (orjson if installed), 'orjson' or 'stdlib'
+	JSON_COMPACT = conf.get('JSON_COMPACT')					# None = compact unless debug
+	JSON_SORT_KEYS = conf.get('JSON_SORT_KEYS', True)
 
 	# jwt
-	JWT_TIMEOUT = conf.get('JWT_TIMEOUT')
\ No newline at end of file
+	JWT_TIMEOUT = conf.get('JWT_TIMEOUT')		# minutes an access token is valid, short with refresh tokens, e.g. 15
+	REFRESH_TOKEN_TTL = conf.get('REFRESH_TOKEN_TTL', 30 * 86400)	# seconds a refresh token family lives unused
+	JWT_KEYS = conf.get('JWT_KEYS', [])					# pem files, the first one signs, empty = HS256 with SECRET_KEY
+	JWT_ACCEPT_HS256 = conf.get('JWT_ACCEPT_HS256', False)	# still accept SECRET_KEY tokens while switching to JWT_KEYS
+	JWKS_MAX_AGE = conf.get('JWKS_MAX_AGE', 3600)			# seconds other services cache /.well-known/jwks.json
+	REVOCATION_CACHE_TTL = conf.get('REVOCATION_CACHE_TTL', 2)		# seconds a worker trusts its last revocation check of a token
+	REVOCATION_CACHE_SIZE = conf.get('REVOCATION_CACHE_SIZE', 10000)	# tokens remembered per worker
+	REVOCATION_RETRY_AFTER = conf.get('REVOCATION_RETRY_AFTER', 2)	# seconds sent in Retry-After when redis is unreachable
\ No newline at end of file
@@ -0,0 +1,243 @@
+import time
+import click
+import itertools
+import threading
+from sqlalchemy import event, Select, create_engine
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.engine import make_url
+from contextlib import contextmanager
+from flask import current_app, has_app_context
+from flask_sqlalchemy.session import Session
+
+
+# ===============================================
+# engine presets per database backend, SQLALCHEMY_ENGINE_OPTIONS from the config wins over them
+
+# applied to every new sqlite connection
+SQLITE_PRAGMAS = {
+	'journal_mode': 'WAL',			# readers don't block the writer and the writer doesn't block readers
+	'synchronous': 'NORMAL',		# safe with WAL, fsync only at checkpoints
+	'busy_timeout': 5000,			# ms to wait for the write lock instead of failing with "database is locked"
+	'mmap_size': 268435456,			# 256 MB memory mapped reads
+	'cache_size': -65536,			# 64 MB page cache per connection (negative = KiB)
+	'temp_store': 'MEMORY',
+}
+
+SERVER_PRESETS = {
+	'postgresql': {
+		'pool_size': 10,
+		'max_overflow': 20,
+		'pool_timeout': 10,
+		'pool_pre_ping': True,		# drop connections the server closed while idle
+		'pool_recycle': 1800,
+	},
+	'mysql': {
+		'pool_size': 10,
+		'max_overflow': 20,
+		'pool_timeout': 10,
+		'pool_pre_ping': True,
+		'pool_recycle': 280,		# below the usual wait_timeout of managed mysql
+	},
+}
+SERVER_PRESETS['mariadb'] = SERVER_PRESETS['mysql']
+
+
+def _backend(uri):
+	return make_url(uri).get_backend_name()
+
+
+def _is_memory_sqlite(uri):
+	return make_url(uri).database in (None, '', ':memory:')
+
+
+# preset engine options for a database uri, overrides replace single keys
+def engine_options(uri, overrides=None):
+	backend = _backend(uri)
+	options = {}
+	if backend == 'sqlite':
+		# a file database is shared by threads through a small pool of connections
+		if not _is_memory_sqlite(uri):
+			options = {'pool_size': 5, 'max_overflow': 10, 'pool_timeout': 10}
+	else:
+		options = dict(SERVER_PRESETS.get(backend, {}))
+	options.update(overrides or {})
+	return options
+
+
+# ===============================================
+# call before db.init_app(app)
+def apply_engine_presets(app):
+	if app.config['DATABASE_PRESETS']:
+		app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+			app.config['SQLALCHEMY_DATABASE_URI'],
+			app.config.get('SQLALCHEMY_ENGINE_OPTIONS')
+		)
+
+
+# call after db.init_app(app), sets the pragmas on every sqlite connection the engines open
+def install_sqlite_pragmas(app, engines):
+	if not app.config['DATABASE_PRESETS']:
+		return
+
+	pragmas = dict(SQLITE_PRAGMAS, **app.config['SQLITE_PRAGMAS'])
+	for engine in engines:
+		if engine.dialect.name != 'sqlite':
+			continue
+		engine_pragmas = dict(pragmas)
+		# an in-memory database has no journal file to put in WAL mode
+		if _is_memory_sqlite(str(engine.url)):
+			engine_pragmas.pop('journal_mode', None)
+		event.listen(engine, 'connect', _pragma_setter(engine_pragmas))
+
+
+def _pragma_setter(pragmas):
+	def set_pragmas(dbapi_connection, connection_record):
+		cursor = dbapi_connection.cursor()
+		for name, value in pragmas.items():
+			cursor.execute(f'PRAGMA {name}={value}')
+		cursor.close()
+	return set_pragmas
+
+
+# ===============================================
+# read replicas
+# SELECTs outside a flush go to a healthy replica picked round robin, everything else uses the primary.
+# Once a session has flushed a write it sticks to the primary so it reads its own writes.
+# Reads in a new request can still hit a replica that lags behind, wrap those in use_primary().
+# A read whose replica can't be reached is run again on the primary, the replica is skipped for the cooldown.
+
+class ReplicaRouter():
+	def __init__(self, engines, cooldown):
+		self.engines = engines
+		self.cooldown = cooldown
+		self._down_until = {}
+		self._cycle = itertools.cycle(range(len(engines)))
+		self._lock = threading.Lock()
+		for engine in engines:
+			event.listen(engine, 'handle_error', self._on_error)
+
+	# next healthy replica, None when all of them are down
+	def pick(self):
+		now = time.monotonic()
+		with self._lock:
+			for _ in range(len(self.engines)):
+				engine = self.engines[next(self._cycle)]
+				if self._down_until.get(engine, 0) <= now:
+					return engine
+		return None
+
+	def mark_down(self, engine):
+		with self._lock:
+			self._down_until[engine] = time.monotonic() + self.cooldown
+
+	# a replica that can't be reached is skipped for the cooldown, then tried again
+	def _on_error(self, context):
+		if context.is_disconnect or context.connection is None:
+			self.mark_down(context.engine)
+
+
+class RoutingSession(Session):
+	_replica = None		# replica the running statement was sent to
+
+	def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+		if bind is None and self._reads_from_replica(clause):
+			router = current_app.extensions.get('db_replicas')
+			engine = router.pick() if router else None
+			if engine is not None:
+				self._replica = engine
+				return engine
+		return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+	def execute(self, statement, *args, **kwargs):
+		return self._with_fallback(super().execute, statement, *args, **kwargs)
+
+	def scalar(self, statement, *args, **kwargs):
+		return self._with_fallback(super().scalar, statement, *args, **kwargs)
+
+	def scalars(self, statement, *args, **kwargs):
+		return self._with_fallback(super().scalars, statement, *args, **kwargs)
+
+	# a replica that refuses the connection or drops it fails only its own read, which goes to the primary.
+	# Reads only reach a replica before the session wrote anything, so dropping its connection loses nothing.
+	def _with_fallback(self, run, statement, *args, **kwargs):
+		self._replica = None
+		try:
+			return run(statement, *args, **kwargs)
+		except DBAPIError as e:
+			replica, self._replica = self._replica, None
+			if replica is None or not (isinstance(e, OperationalError) or e.connection_invalidated):
+				raise
+			current_app.logger.warning(f'replica {replica.url.host or replica.url.database} failed, reading from the primary: {e.orig!r}')
+
+		current_app.extensions['db_replicas'].mark_down(replica)
+		self._drop_connection(replica)
+		previous = self.info.get('primary')
+		self.info['primary'] = True
+		try:
+			return run(statement, *args, **kwargs)
+		finally:
+			self.info['primary'] = previous
+
+	# the broken replica connection would fail the commit of the session, roll it back alone
+	def _drop_connection(self, engine):
+		transaction = self.get_transaction()
+		entry = transaction._connections.pop(engine, None) if transaction is not None else None
+		if entry is not None:
+			connection, connection_transaction = entry[0], entry[1]
+			transaction._connections.pop(connection, None)
+			try:
+				connection_transaction.rollback()
+			finally:
+				connection.close()
+
+	def _reads_from_replica(self, clause):
+		return (
+			has_app_context()
+			and isinstance(clause, Select)
+			and clause._for_update_arg is None
+			and not self._flushing
+			and not self.info.get('primary')
+		)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _stick_to_primary(session, flush_context):
+	session.info['primary'] = True
+
+
+# send every query of the block to the primary, for read-then-write paths sensitive to replica lag
+@contextmanager
+def use_primary():
+	from flaskapp import db
+	session = db.session()
+	previous = session.info.get('primary')
+	session.info['primary'] = True
+	try:
+		yield session
+	finally:
+		session.info['primary'] = previous
+
+
+# call after db.init_app(app)
+def install_replicas(app):
+	uris = app.config['SQLALCHEMY_REPLICA_URIS']
+	if not uris:
+		return
+
+	engines = []
+	for uri in uris:
+		options = engine_options(uri, app.config.get('SQLALCHEMY_ENGINE_OPTIONS')) if app.config['DATABASE_PRESETS'] else {}
+		engines.append(create_engine(uri, **options))
+	install_sqlite_pragmas(app, engines)
+	app.extensions['db_replicas'] = ReplicaRouter(engines, app.config['REPLICA_COOLDOWN'])
+
+
+# ===============================================
+# flask --app wsgi init-db
+# tables are created once before the first start, not on every import of the app
+@click.command('init-db')
+def init_db_command():
+	"""Create the database tables that don't exist yet."""
+	from flaskapp import db
+	db.create_all()
+	click.echo('Database tables created.')
@@ -1,26 +1,44 @@
 from flaskapp import db
 from datetime import datetime
+from sqlalchemy.orm import validates
 
 class User(db.Model):
 	__tablename__ = 'user'
 	id = db.Column(db.Integer, primary_key=True)
 	username = db.Column(db.String(20), unique=True, nullable=False)
-	email = db.Column(db.String(30), unique=True, nullable=False)
+	email = db.Column(db.String(254), unique=True, nullable=False)
+	# lowercased email, every lookup by email goes through this unique index
+	email_normalized = db.Column(db.String(254), unique=True, nullable=False)
 	password = db.Column(db.String(60), nullable=False)
 	date_created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
-	# username check while creating account
 	@staticmethod
-	def check_name(name):
-		name = name.strip().replace(' ', '-').lower()
-		user = User.query.filter_by(username=name).first()
-		return True if user else False
+	def normalize_name(name):
+		return name.strip().replace(' ', '-').lower()
 
-	# email check while creating account
 	@staticmethod
-	def check_email(email):
-		user = User.query.filter_by(email=email).first()
-		return True if user else False
+	def normalize_email(email):
+		return email.strip().lower()
+
+	# keep the lookup column in sync whenever the email is set
+	@validates('email')
+	def _set_email(self, key, email):
+		self.email_normalized = User.normalize_email(email)
+		return email
+
+	# which of username / email are already taken, one query with two EXISTS and no row loaded
+	@staticmethod
+	def check_taken(name, email):
+		row = db.session.execute(db.select(
+			db.exists().where(User.username == User.normalize_name(name)).label('name'),
+			db.exists().where(User.email_normalized == User.normalize_email(email)).label('email')
+		)).one()
+		return {'name': bool(row.name), 'email': bool(row.email)}
+
+	# case insensitive lookup by email
+	@staticmethod
+	def get_by_email(email):
+		return User.query.filter_by(email_normalized=User.normalize_email(email)).first()
 
 	def __repr__(self):
-		return f'username: {self.username} | email: {self.email}'
\ No newline at end of file
+		return f'username: {self.username} | email: {self.email}'
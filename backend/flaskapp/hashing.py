@@ -0,0 +1,220 @@
+import time
+import bcrypt
+import threading
+import multiprocessing
+from flask import jsonify
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flaskapp.metrics import observe
+
+
+# bcrypt cost bounds used by the calibration
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+
+
+# raised when every worker is busy and the waiting queue is full
+class HashingBusy(Exception):
+	def __init__(self, retry_after):
+		super().__init__('Password hashing queue is full.')
+		self.retry_after = retry_after
+
+
+# bcrypt hash of a password at the given cost, the cost of the app is Hasher.rounds
+# module level so other process pools can run it too (the cli import)
+def hash_password(password, rounds):
+	return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+# ===============================================
+# functions executed inside the worker processes
+# both return (result, start timestamp, hash duration) so the caller can measure queue wait
+def _hash(password, rounds):
+	started = time.time()
+	begin = time.perf_counter()
+	hashed = hash_password(password, rounds)
+	return hashed, started, time.perf_counter() - begin
+
+
+def _check(pw_hash, password):
+	started = time.time()
+	begin = time.perf_counter()
+	try:
+		matched = bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+	except ValueError:
+		matched = False
+	return matched, started, time.perf_counter() - begin
+
+
+# cost factor stored in a hash, '$2b$13$...' -> 13
+def get_rounds(pw_hash):
+	try:
+		return int(pw_hash.split('$')[2])
+	except (IndexError, ValueError):
+		return None
+
+
+# pick the highest cost whose hash time still fits the budget on this host
+def calibrate(budget_ms, min_rounds=MIN_ROUNDS, max_rounds=MAX_ROUNDS):
+	rounds = min_rounds
+	elapsed = _hash('calibration', rounds)[2] * 1000
+	# every extra round doubles the work
+	while rounds < max_rounds and elapsed * 2 <= budget_ms:
+		rounds += 1
+		elapsed = _hash('calibration', rounds)[2] * 1000
+	if elapsed > budget_ms and rounds > min_rounds:
+		rounds -= 1
+	return rounds
+
+
+# ===============================================
+# running totals for one kind of operation (hash or check)
+class _Timing():
+	def __init__(self):
+		self.count = 0
+		self.wait_total = 0.0
+		self.wait_max = 0.0
+		self.hash_total = 0.0
+		self.hash_max = 0.0
+
+	def add(self, wait, elapsed):
+		self.count += 1
+		self.wait_total += wait
+		self.wait_max = max(self.wait_max, wait)
+		self.hash_total += elapsed
+		self.hash_max = max(self.hash_max, elapsed)
+
+	def as_dict(self):
+		count = self.count or 1
+		return {
+			'count': self.count,
+			'queue_wait_avg_ms': round(self.wait_total / count * 1000, 3),
+			'queue_wait_max_ms': round(self.wait_max * 1000, 3),
+			'hash_time_avg_ms': round(self.hash_total / count * 1000, 3),
+			'hash_time_max_ms': round(self.hash_max * 1000, 3),
+		}
+
+
+# ===============================================
+class Hasher():
+	"""
+	Runs bcrypt in a dedicated process pool so a slow hash never pins a web worker.
+	At most HASH_WORKERS + HASH_QUEUE_DEPTH calls can be in flight, anything beyond that
+	raises HashingBusy which is answered with 503 and a Retry-After header.
+	HASH_WORKERS = 0 hashes inline in the calling thread (development and tests).
+	The cost (rounds) is BCRYPT_LOG_ROUNDS, or calibrated at startup when HASH_TIME_BUDGET_MS is set.
+	"""
+	def __init__(self, app=None):
+		self.workers = 0
+		self.queue_depth = 0
+		self.retry_after = 1
+		self.rounds = 12
+		self._executor = None
+		self._executor_pid = None
+		self._slots = None
+		self._lock = threading.Lock()
+		self._timings = {'hash': _Timing(), 'check': _Timing()}
+		self.rejected = 0
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		self.workers = app.config.get('HASH_WORKERS', 0)
+		self.queue_depth = app.config.get('HASH_QUEUE_DEPTH', 0)
+		self.retry_after = app.config.get('HASH_RETRY_AFTER', 1)
+		self.rounds = app.config.get('BCRYPT_LOG_ROUNDS', 12)
+
+		budget_ms = app.config.get('HASH_TIME_BUDGET_MS')
+		if budget_ms:
+			self.rounds = calibrate(budget_ms, max_rounds=app.config.get('HASH_MAX_ROUNDS', MAX_ROUNDS))
+			app.logger.info(f'bcrypt cost calibrated to {self.rounds} for a {budget_ms} ms budget')
+
+		self._slots = threading.BoundedSemaphore(max(self.workers, 1) + self.queue_depth)
+		app.register_error_handler(HashingBusy, self._busy_response)
+
+	def generate_password_hash(self, password):
+		return self._run('hash', _hash, password, self.rounds)
+
+	def check_password_hash(self, pw_hash, password):
+		return self._run('check', _check, pw_hash, password)
+
+	# stored hash was made with a different cost than the current one
+	def needs_rehash(self, pw_hash):
+		return get_rounds(pw_hash) != self.rounds
+
+	def stats(self):
+		with self._lock:
+			data = {name: timing.as_dict() for name, timing in self._timings.items()}
+			data['rejected'] = self.rejected
+		return data
+
+	def shutdown(self):
+		with self._lock:
+			if self._executor is not None:
+				self._executor.shutdown(wait=False, cancel_futures=True)
+			self._executor = None
+			self._executor_pid = None
+
+	# in a forked worker the parent's pool and lock are not ours, forget them without touching them
+	def after_fork(self):
+		self._lock = threading.Lock()
+		self._executor = None
+		self._executor_pid = None
+
+	# start every pool process and load bcrypt in it at the cheapest cost
+	def warm_up(self):
+		if not self.workers:
+			_hash('warm-up', 4)
+			return
+		executor = self._get_executor()
+		for future in [executor.submit(_hash, 'warm-up', 4) for _ in range(self.workers)]:
+			future.result()
+
+	# executor is created on first use so it is never inherited by a forked child
+	def _get_executor(self):
+		with self._lock:
+			if self._executor is None or self._executor_pid != multiprocessing.current_process().pid:
+				ctx = multiprocessing.get_context('spawn')
+				self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+				self._executor_pid = multiprocessing.current_process().pid
+			return self._executor
+
+	def _run(self, name, fn, *args):
+		if not self._slots.acquire(blocking=False):
+			with self._lock:
+				self.rejected += 1
+			raise HashingBusy(self.retry_after)
+
+		try:
+			submitted = time.time()
+			if self.workers:
+				result, started, elapsed = self._submit(fn, *args)
+			else:
+				result, started, elapsed = fn(*args)
+		finally:
+			self._slots.release()
+
+		wait = max(started - submitted, 0.0)
+		with self._lock:
+			self._timings[name].add(wait, elapsed)
+		observe('bcrypt', name, elapsed)
+		observe('bcrypt', f'{name}_queue', wait)
+		return result
+
+	# a pool one of whose processes died stays broken, it is replaced and the call tried once more
+	def _submit(self, fn, *args):
+		executor = self._get_executor()
+		try:
+			return executor.submit(fn, *args).result()
+		except BrokenProcessPool:
+			with self._lock:
+				if self._executor is executor:
+					self._executor = None
+			executor.shutdown(wait=False, cancel_futures=True)
+			return self._get_executor().submit(fn, *args).result()
+
+	def _busy_response(self, error):
+		response = jsonify({"error": "Server is busy, please try again."})
+		response.status_code = 503
+		response.headers['Retry-After'] = str(error.retry_after)
+		return response
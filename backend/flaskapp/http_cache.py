@@ -0,0 +1,95 @@
+import redis
+import hashlib
+from functools import wraps
+from flask import request, current_app, make_response
+from flaskapp import redis_client
+
+
+# ===============================================
+# conditional GET for read endpoints
+# every 200 gets a strong ETag from a hash of its body and a Cache-Control policy,
+# a request whose If-None-Match still matches gets an empty 304.
+#
+# With RESPONSE_CACHE_ENABLED and the redis backend, rendered bodies are also kept in redis for
+# server_ttl seconds so a hit skips the route. Private entries are keyed per user and per
+# snapshot of the user, a renamed user gets a new key instead of an invalidation.
+
+def _etag(body):
+	return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def _user_version(user):
+	from flaskapp.user_cache import UserCache
+	snapshot = '|'.join(str(getattr(user, name)) for name in UserCache.FIELDS)
+	return _etag(snapshot.encode('utf-8'))[:12]
+
+
+def _server_key(private, args):
+	if private:
+		user = args[0]
+		return f'page:{request.endpoint}:{user.id}:{_user_version(user)}'
+	return f'page:{request.endpoint}:public'
+
+
+def _load(key):
+	try:
+		return redis_client.hgetall(key) or None
+	except redis.RedisError:
+		return None
+
+
+def _store(key, response, etag, ttl):
+	try:
+		pipe = redis_client.pipeline()
+		pipe.hset(key, mapping={'body': response.get_data(as_text=True), 'etag': etag, 'mimetype': response.mimetype})
+		pipe.expire(key, ttl)
+		pipe.execute()
+	except redis.RedisError:
+		pass
+
+
+def _cache_control(response, max_age, private):
+	if private:
+		# only the browser may keep it, and it has to revalidate when max_age is 0
+		response.cache_control.private = True
+		response.vary.add('Authorization')
+	else:
+		response.cache_control.public = True
+	if max_age:
+		response.cache_control.max_age = max_age
+	else:
+		response.cache_control.no_cache = True
+
+
+# place it below login_required for private routes, the user is the first argument
+#   max_age     seconds clients may reuse the response without asking, 0 = revalidate every time
+#   private     per user response, never stored by shared caches
+#   server_ttl  seconds the rendered response is kept in redis, None = not kept
+def cache_response(max_age=0, private=False, server_ttl=None):
+	def decorator(f):
+		@wraps(f)
+		def inner(*args, **kwargs):
+			if request.method not in ('GET', 'HEAD'):
+				return f(*args, **kwargs)
+
+			key = None
+			if server_ttl and current_app.config['RESPONSE_CACHE_ENABLED'] and current_app.config['STATE_BACKEND'] == 'redis':
+				key = _server_key(private, args)
+
+			cached = _load(key) if key else None
+			if cached:
+				response = current_app.response_class(cached['body'], mimetype=cached['mimetype'])
+				etag = cached['etag']
+			else:
+				response = make_response(f(*args, **kwargs))
+				if response.status_code != 200:
+					return response
+				etag = _etag(response.get_data())
+				if key:
+					_store(key, response, etag, server_ttl)
+
+			response.set_etag(etag)
+			_cache_control(response, max_age, private)
+			return response.make_conditional(request)
+		return inner
+	return decorator
@@ -0,0 +1,79 @@
+import datetime
+from flask.json.provider import DefaultJSONProvider, _default as flask_default
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+
+# ===============================================
+# json for jsonify() and request.get_json()
+# orjson when it is installed and JSON_BACKEND allows it, the stdlib json module otherwise.
+# Both write datetimes as ISO 8601, naive ones are UTC (User.date_created is datetime.utcnow).
+
+def _iso(value):
+	if isinstance(value, datetime.datetime) and value.tzinfo is None:
+		value = value.replace(tzinfo=datetime.timezone.utc)
+	return value.isoformat()
+
+
+# stdlib fallback, dates the same way orjson writes them
+def _default(o):
+	if isinstance(o, datetime.date):
+		return _iso(o)
+	return flask_default(o)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+	default = staticmethod(_default)
+
+	def __init__(self, app):
+		super().__init__(app)
+		backend = app.config['JSON_BACKEND']
+		if backend == 'orjson' and orjson is None:
+			raise RuntimeError('JSON_BACKEND is orjson but orjson is not installed')
+		self.use_orjson = orjson is not None and backend != 'stdlib'
+		self.compact = app.config['JSON_COMPACT']
+		self.sort_keys = app.config['JSON_SORT_KEYS']
+
+	def _option(self, indent=None):
+		option = orjson.OPT_NAIVE_UTC
+		if self.sort_keys:
+			option |= orjson.OPT_SORT_KEYS
+		if indent:
+			option |= orjson.OPT_INDENT_2
+		return option
+
+	# anything orjson rejects (int over 64 bits, non string keys) goes through the stdlib,
+	# types it doesn't know (decimal, markup) through flask's default
+	def _orjson_dumps(self, obj, option):
+		try:
+			return orjson.dumps(obj, default=flask_default, option=option)
+		except TypeError:
+			return None
+
+	def dumps(self, obj, **kwargs):
+		if self.use_orjson and kwargs.keys() <= {'indent', 'separators', 'sort_keys'}:
+			if kwargs.get('sort_keys', self.sort_keys) == self.sort_keys:
+				data = self._orjson_dumps(obj, self._option(kwargs.get('indent')))
+				if data is not None:
+					return data.decode('utf-8')
+		return super().dumps(obj, **kwargs)
+
+	def loads(self, s, **kwargs):
+		if self.use_orjson and not kwargs:
+			return orjson.loads(s)
+		return super().loads(s, **kwargs)
+
+	# the response body is built from bytes, no str round trip
+	def response(self, *args, **kwargs):
+		if not self.use_orjson:
+			return super().response(*args, **kwargs)
+
+		obj = self._prepare_response_obj(args, kwargs)
+		indent = (self.compact is None and self._app.debug) or self.compact is False
+		data = self._orjson_dumps(obj, self._option(indent) | orjson.OPT_APPEND_NEWLINE)
+		if data is None:
+			return super().response(*args, **kwargs)
+		return self._app.response_class(data, mimetype=self.mimetype)
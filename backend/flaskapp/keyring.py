@@ -0,0 +1,147 @@
+import os
+import jwt
+import click
+import base64
+import hashlib
+from flask import jsonify
+
+
+class Keyring():
+	"""
+	Keys signing and verifying the access tokens, kept in memory.
+	Without JWT_KEYS the tokens are HS256 with SECRET_KEY. With JWT_KEYS the first key signs
+	(EdDSA for ed25519 keys, RS256 for rsa keys) and its kid goes into the token header,
+	every key verifies and is published on /.well-known/jwks.json for the other services.
+
+	Rotation: append the new key, wait JWKS_MAX_AGE so every service fetched it, move it first,
+	then drop the old key once the last token it signed expired (JWT_TIMEOUT).
+	"""
+	def __init__(self, app=None):
+		self.secret = None
+		self.signing = None		# (kid, algorithm, private key)
+		self.verifying = {}		# kid -> (algorithm, public key)
+		self.accept_hs256 = True
+		self.jwks = {'keys': []}
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		self.secret = app.config['SECRET_KEY']
+		self.signing = None
+		self.verifying = {}
+		jwks = []
+
+		for entry in app.config['JWT_KEYS']:
+			kid, algorithm, private_key, public_key = load_key(entry)
+			if kid in self.verifying:
+				raise ValueError(f'JWT_KEYS: kid {kid!r} is used twice.')
+			if self.signing is None:
+				if private_key is None:
+					raise ValueError(f'JWT_KEYS: the first key {kid!r} signs, it must be a private key.')
+				self.signing = (kid, algorithm, private_key)
+			self.verifying[kid] = (algorithm, public_key)
+			jwks.append(_jwk(kid, algorithm, public_key))
+
+		# tokens without a kid are the HS256 ones, accepted while switching to JWT_KEYS
+		self.accept_hs256 = self.signing is None or app.config['JWT_ACCEPT_HS256']
+		self.jwks = {'keys': jwks}
+
+		# public and cached by clients, a new key is seen by the other services within JWKS_MAX_AGE
+		from flaskapp.http_cache import cache_response
+		app.add_url_rule('/.well-known/jwks.json', 'jwks', cache_response(max_age=app.config['JWKS_MAX_AGE'])(self._jwks_view))
+
+	def encode(self, payload):
+		if self.signing is None:
+			return jwt.encode(payload, self.secret, algorithm='HS256')
+		kid, algorithm, private_key = self.signing
+		return jwt.encode(payload, private_key, algorithm=algorithm, headers={'kid': kid})
+
+	# the key is picked by kid and only its own algorithm is allowed, raises jwt.InvalidTokenError
+	def decode(self, token):
+		kid = jwt.get_unverified_header(token).get('kid')
+		if kid is None:
+			if not self.accept_hs256:
+				raise jwt.InvalidTokenError('Token without kid.')
+			return jwt.decode(token, self.secret, algorithms=['HS256'])
+
+		key = self.verifying.get(kid) if isinstance(kid, str) else None
+		if key is None:
+			raise jwt.InvalidTokenError('Unknown kid.')
+		algorithm, public_key = key
+		return jwt.decode(token, public_key, algorithms=[algorithm])
+
+	def _jwks_view(self):
+		return jsonify(self.jwks)
+
+
+# ===============================================
+# JWT_KEYS entries are a pem path or {"path": ..., "kid": ...}, returns (kid, algorithm, private key, public key)
+# a public key pem verifies only, for a retired key whose tokens are still valid
+def load_key(entry):
+	from cryptography.hazmat.primitives import serialization
+	from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+	if isinstance(entry, str):
+		entry = {'path': entry}
+	with open(entry['path'], 'rb') as f:
+		pem = f.read()
+
+	if b'PRIVATE KEY' in pem:
+		private_key = serialization.load_pem_private_key(pem, password=None)
+		public_key = private_key.public_key()
+	else:
+		private_key = None
+		public_key = serialization.load_pem_public_key(pem)
+
+	if isinstance(public_key, ed25519.Ed25519PublicKey):
+		algorithm = 'EdDSA'
+	elif isinstance(public_key, rsa.RSAPublicKey):
+		if public_key.key_size < 2048:
+			raise ValueError(f"JWT_KEYS: {entry['path']} is a {public_key.key_size} bit rsa key, at least 2048 are needed.")
+		algorithm = 'RS256'
+	else:
+		raise ValueError(f"JWT_KEYS: {entry['path']} is neither an ed25519 nor an rsa key.")
+
+	return entry.get('kid') or key_id(public_key), algorithm, private_key, public_key
+
+
+# default kid, a short digest of the public key so the same key always gets the same id
+def key_id(public_key):
+	from cryptography.hazmat.primitives import serialization
+
+	der = public_key.public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+	return base64.urlsafe_b64encode(hashlib.sha256(der).digest()[:12]).decode()
+
+
+def _jwk(kid, algorithm, public_key):
+	from jwt.algorithms import OKPAlgorithm, RSAAlgorithm
+
+	to_jwk = OKPAlgorithm.to_jwk if algorithm == 'EdDSA' else RSAAlgorithm.to_jwk
+	return {**to_jwk(public_key, as_dict=True), 'kid': kid, 'alg': algorithm, 'use': 'sig'}
+
+
+# ===============================================
+# new private key for JWT_KEYS
+#   flask --app wsgi jwt-keygen /etc/flaskapp/jwt-2026-10.pem [--type rsa]
+@click.command('jwt-keygen')
+@click.argument('path')
+@click.option('--type', 'key_type', type=click.Choice(['ed25519', 'rsa']), default='ed25519')
+def jwt_keygen_command(path, key_type):
+	"""Write a new signing key for JWT_KEYS."""
+	from cryptography.hazmat.primitives import serialization
+	from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+	if key_type == 'rsa':
+		private_key = rsa.generate_private_key(public_exponent=65537, key_size=3072)
+	else:
+		private_key = ed25519.Ed25519PrivateKey.generate()
+	pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+
+	# readable by the owner only, an existing key is never overwritten
+	try:
+		fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+	except FileExistsError:
+		raise click.ClickException(f'{path} already exists.')
+	with os.fdopen(fd, 'wb') as f:
+		f.write(pem)
+	click.echo(f'{path} written, kid {key_id(private_key.public_key())}')
@@ -0,0 +1,62 @@
+import time
+import redis
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from flaskapp import db, hasher, redis_client
+
+
+# ===============================================
+# hooks for pre-forking servers, called from gunicorn.conf.py
+# the app is created once in the master, every worker is a fork of it
+
+def _engines(app):
+	with app.app_context():
+		engines = list(db.engines.values())
+	router = app.extensions.get('db_replicas')
+	if router:
+		engines += router.engines
+	return engines
+
+
+# a worker must not share the sockets the master opened before the fork
+def after_fork(app):
+	for engine in _engines(app):
+		# close=False leaves the parent's connections alone, the child just forgets them
+		engine.dispose(close=False)
+	redis_client.after_fork()
+	hasher.after_fork()
+
+
+# pay the cold start costs before the worker accepts requests, returns the seconds it took
+#   connections  database connections opened per engine, one per thread keeps them all warm
+def warm_up(app, connections=1):
+	begin = time.perf_counter()
+
+	# a warm up failure is logged, the worker still starts and retries on the first request
+	for engine in _engines(app):
+		try:
+			opened = [engine.connect() for _ in range(connections)]
+			opened[0].execute(text('SELECT 1'))
+			for conn in opened:
+				conn.close()
+		except SQLAlchemyError as e:
+			app.logger.warning(f'warm up: {engine.url!r} is unreachable, {e!r}')
+
+	if app.config['STATE_BACKEND'] == 'redis':
+		try:
+			redis_client.ping()
+		except redis.RedisError as e:
+			app.logger.warning(f'warm up: redis is unreachable, {e!r}')
+
+	# bcrypt pool processes, the user bloom filter and a request through the whole stack
+	# (url matcher, json provider, cache headers), the regexes are compiled at import in the master
+	hasher.warm_up()
+	with app.app_context():
+		from flaskapp.users.bloom import get_bloom
+		try:
+			get_bloom().ensure_built()
+		except (redis.RedisError, SQLAlchemyError) as e:
+			app.logger.warning(f'warm up: user bloom filter not built, {e!r}')
+	app.test_client().get('/api-v1/main/home/')
+
+	return time.perf_counter() - begin
@@ -1,8 +1,10 @@
 from flask import Blueprint, jsonify
+from flaskapp.http_cache import cache_response
 
 main_bp = Blueprint("main", __name__)
 
 @main_bp.route("/home/")
+@cache_response(max_age=300, server_ttl=300)
 def home():
 	return jsonify("This is homepage.")
 
@@ -0,0 +1,145 @@
+import os
+import hmac
+import time
+from sqlalchemy import event
+from flask import request, current_app, jsonify, g
+
+
+# ===============================================
+# prometheus metrics, served on /metrics when METRICS_ENABLED is set
+# Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR (see gunicorn.conf.py)
+# and a scrape adds up the files of all workers, without it the numbers are those of one process.
+# prometheus_client is imported by init_app, after gunicorn.conf.py has set that variable.
+# worker.py serves no requests, it exposes its own numbers (the smtp timings) with start_http_server().
+
+REQUESTS = None
+LATENCY = None
+DEPENDENCY = None
+DEPENDENCY_ERRORS = None
+
+# set by init_app, observe() is a no-op until then
+_enabled = False
+
+
+# record one call to a dependency, operation is a small fixed set (command name, sql verb ...)
+def observe(dependency, operation, seconds, failed=False):
+	if not _enabled:
+		return
+	DEPENDENCY.labels(dependency, operation).observe(seconds)
+	if failed:
+		DEPENDENCY_ERRORS.labels(dependency, operation).inc()
+
+
+def _create_metrics():
+	global REQUESTS, LATENCY, DEPENDENCY, DEPENDENCY_ERRORS
+	from prometheus_client import Counter, Histogram
+
+	REQUESTS = Counter(
+		'http_requests_total', 'Requests by route, method and status',
+		['route', 'method', 'status']
+	)
+	LATENCY = Histogram(
+		'http_request_duration_seconds', 'Request latency by route',
+		['route', 'method'],
+		buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+	)
+	DEPENDENCY = Histogram(
+		'dependency_duration_seconds', 'Time spent in bcrypt, redis, the database and smtp',
+		['dependency', 'operation'],
+		buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+	)
+	DEPENDENCY_ERRORS = Counter(
+		'dependency_errors_total', 'Failed calls to bcrypt, redis, the database and smtp',
+		['dependency', 'operation']
+	)
+
+
+# ===============================================
+def init_app(app, engines):
+	global _enabled
+	if not app.config['METRICS_ENABLED']:
+		return
+	# metrics are registered once per process, a second app reuses them
+	if not _enabled:
+		_create_metrics()
+	_enabled = True
+
+	app.before_request(_start_timer)
+	app.after_request(_record_request)
+	app.add_url_rule('/metrics', 'metrics', _metrics_view)
+
+	for engine in engines:
+		_instrument_engine(engine)
+
+
+# metrics of a process without a web server on addr:port, the outbox worker
+def start_http_server(port, addr='127.0.0.1'):
+	if not _enabled or not port:
+		return False
+	import prometheus_client
+	prometheus_client.start_http_server(port, addr=addr)
+	return True
+
+
+def _start_timer():
+	g.request_started = time.perf_counter()
+
+
+# the route template keeps the label set bounded, unknown urls share one label
+def _record_request(response):
+	started = g.pop('request_started', None)
+	if started is None or request.endpoint == 'metrics':
+		return response
+
+	route = request.url_rule.rule if request.url_rule else '<unmatched>'
+	REQUESTS.labels(route, request.method, response.status_code).inc()
+	LATENCY.labels(route, request.method).observe(time.perf_counter() - started)
+	return response
+
+
+def _metrics_view():
+	token = current_app.config['METRICS_TOKEN']
+	if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+		return jsonify({"error": "Forbidden response!"}), 403
+
+	from prometheus_client import CollectorRegistry, REGISTRY, generate_latest, CONTENT_TYPE_LATEST, multiprocess
+	if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+		registry = CollectorRegistry()
+		multiprocess.MultiProcessCollector(registry)
+	else:
+		registry = REGISTRY
+	return current_app.response_class(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+# ===============================================
+# sql timings from the engine events, labelled with the statement verb
+SQL_VERBS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE')
+
+
+def _sql_verb(statement):
+	verb = statement.lstrip()[:6].upper()
+	return verb if verb in SQL_VERBS else 'OTHER'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+	context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+	started = getattr(context, '_metrics_started', None)
+	if started is not None:
+		observe('database', _sql_verb(statement), time.perf_counter() - started)
+
+
+def _handle_error(context):
+	started = getattr(context.execution_context, '_metrics_started', None)
+	if started is not None:
+		observe('database', _sql_verb(context.statement or ''), time.perf_counter() - started, failed=True)
+
+
+def _instrument_engine(engine):
+	if event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+		return
+	event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+	event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+	event.listen(engine, 'handle_error', _handle_error)
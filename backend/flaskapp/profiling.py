@@ -0,0 +1,176 @@
+import os
+import re
+import glob
+import hmac
+import time
+import random
+import cProfile
+import threading
+import tracemalloc
+from flask import request, current_app, jsonify
+
+
+# ===============================================
+# on demand cpu profiles and memory snapshots, installed only when PROFILING_ENABLED is set
+# a request is profiled when it sends "X-Profile: <PROFILING_TOKEN>" or is picked by PROFILING_SAMPLE_RATE,
+# the pstats file goes to PROFILING_DIR where only the newest PROFILING_KEEP files are kept
+#   python -m pstats <PROFILING_DIR>/<file>.prof, or snakeviz / flameprof for a flame graph
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+
+
+def _authorized(supplied, token):
+	# no token configured means nobody is allowed, not everybody
+	return bool(token) and hmac.compare_digest(supplied.encode('latin-1', 'replace'), token.encode())
+
+
+class ProfilerMiddleware():
+	"""Wsgi middleware running the selected requests under cProfile, including the response body."""
+	def __init__(self, wsgi_app, directory, keep=100, sample_rate=0.0, token=None):
+		# files[:-0] would prune nothing, and the X-Profile-Id must name a file that is still there
+		if keep < 1:
+			raise ValueError(f'PROFILING_KEEP: at least 1 pstats file has to be kept, got {keep}.')
+		self.wsgi_app = wsgi_app
+		self.directory = directory
+		self.keep = keep
+		self.sample_rate = sample_rate
+		self.token = token
+		os.makedirs(directory, exist_ok=True)
+
+	def __call__(self, environ, start_response):
+		if not self._selected(environ):
+			return self.wsgi_app(environ, start_response)
+
+		name = self._file_name(environ)
+
+		def capture_start_response(status, headers, exc_info=None):
+			headers.append(('X-Profile-Id', name))
+			return start_response(status, headers, exc_info)
+
+		profile = cProfile.Profile()
+		begin = time.perf_counter()
+		body = profile.runcall(self._run, environ, capture_start_response)
+		elapsed = time.perf_counter() - begin
+
+		self._save(profile, f'{name}-{elapsed * 1000:.0f}ms.prof')
+		return body
+
+	def _run(self, environ, start_response):
+		app_iter = self.wsgi_app(environ, start_response)
+		try:
+			return [b''.join(app_iter)]
+		finally:
+			if hasattr(app_iter, 'close'):
+				app_iter.close()
+
+	def _selected(self, environ):
+		supplied = environ.get(PROFILE_HEADER)
+		if supplied is not None:
+			return _authorized(supplied, self.token)
+		return self.sample_rate > 0 and random.random() < self.sample_rate
+
+	# newest last when sorted, the pid keeps the workers of one server apart
+	def _file_name(self, environ):
+		path = re.sub(r'[^A-Za-z0-9]+', '_', environ.get('PATH_INFO', '')).strip('_')[:60] or 'root'
+		return f"{time.time() * 1000:.0f}-{os.getpid()}-{environ.get('REQUEST_METHOD', 'GET')}-{path}"
+
+	def _save(self, profile, file_name):
+		profile.dump_stats(os.path.join(self.directory, file_name))
+
+		# several workers prune the same directory, a file may already be gone
+		files = sorted(glob.glob(os.path.join(self.directory, '*.prof')), key=os.path.basename)
+		for old in files[:-self.keep]:
+			try:
+				os.remove(old)
+			except FileNotFoundError:
+				pass
+
+
+# ===============================================
+# tracemalloc snapshots of this worker, each POST is compared with the one before it
+#   POST /debug/memory      starts tracing, then takes a snapshot and returns the top growth
+#   DELETE /debug/memory    stops tracing and drops the snapshots
+# every worker traces on its own, the pid in the answer tells which one answered
+
+_snapshot_lock = threading.Lock()
+_last_snapshot = None
+
+SNAPSHOT_FILTERS = (
+	tracemalloc.Filter(False, tracemalloc.__file__),
+	tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+	tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+	tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+def _memory_view():
+	global _last_snapshot
+	token = current_app.config['PROFILING_TOKEN']
+	if not _authorized(request.headers.get('Authorization', ''), token and f'Bearer {token}'):
+		return jsonify({"error": "Forbidden response!"}), 403
+
+	with _snapshot_lock:
+		if request.method == 'DELETE':
+			_last_snapshot = None
+			tracemalloc.stop()
+			return jsonify({"pid": os.getpid(), "tracing": False})
+
+		if not tracemalloc.is_tracing():
+			tracemalloc.start(current_app.config['TRACEMALLOC_FRAMES'])
+			_last_snapshot = None
+			return jsonify({"pid": os.getpid(), "tracing": True, "message": "Tracing started, post again for a snapshot."})
+
+		group = request.args.get('group', 'lineno')
+		if group not in ('lineno', 'filename', 'traceback'):
+			return jsonify({"error": "group must be lineno, filename or traceback."}), 400
+		limit = request.args.get('limit', 20, type=int)
+
+		snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+		previous, _last_snapshot = _last_snapshot, snapshot
+
+	if previous is None:
+		stats = [{
+			"where": _where(stat.traceback, group),
+			"size_kb": round(stat.size / 1024, 1),
+			"count": stat.count
+		} for stat in snapshot.statistics(group)[:limit]]
+	else:
+		stats = [{
+			"where": _where(stat.traceback, group),
+			"size_kb": round(stat.size / 1024, 1),
+			"size_diff_kb": round(stat.size_diff / 1024, 1),
+			"count_diff": stat.count_diff
+		} for stat in snapshot.compare_to(previous, group)[:limit]]
+
+	current, peak = tracemalloc.get_traced_memory()
+	return jsonify({
+		"pid": os.getpid(),
+		"tracing": True,
+		"compared": previous is not None,
+		"traced_kb": round(current / 1024, 1),
+		"peak_kb": round(peak / 1024, 1),
+		"top": stats
+	})
+
+
+def _where(traceback, group):
+	frames = traceback if group == 'traceback' else traceback[:1]
+	if group == 'filename':
+		return frames[0].filename
+	return ' <- '.join(f'{frame.filename}:{frame.lineno}' for frame in frames)
+
+
+# ===============================================
+def init_app(app):
+	# nothing is installed when disabled, requests take the usual path
+	if not app.config['PROFILING_ENABLED']:
+		return
+
+	app.wsgi_app = ProfilerMiddleware(
+		app.wsgi_app,
+		app.config['PROFILING_DIR'],
+		keep=app.config['PROFILING_KEEP'],
+		sample_rate=app.config['PROFILING_SAMPLE_RATE'],
+		token=app.config['PROFILING_TOKEN']
+	)
+	app.add_url_rule('/debug/memory', 'debug_memory', _memory_view, methods=['POST', 'DELETE'])
@@ -0,0 +1,187 @@
+import math
+import time
+import redis
+import threading
+from functools import wraps
+from flask import request, current_app, jsonify
+from flaskapp import redis_client
+
+
+# ===============================================
+# sliding window counter
+# the count of the previous window is weighted by how much of it still overlaps the sliding window,
+# so only two counters per key are kept instead of a log of every hit
+
+# KEYS[1] current window counter, KEYS[2] previous window counter
+# ARGV[1] limit, ARGV[2] window seconds, ARGV[3] elapsed fraction of the current window
+# returns 1 when the hit is allowed, 0 when the limit is reached
+SLIDING_WINDOW = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+local estimate = previous * (1 - tonumber(ARGV[3])) + current
+if estimate >= tonumber(ARGV[1]) then
+	return 0
+end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]) * 2)
+return 1
+"""
+
+
+class _LocalCounters():
+	"""Same counters in process memory, used by the memory backend and when redis is unreachable."""
+	def __init__(self, max_keys=100000):
+		self.max_keys = max_keys
+		self._counts = {}
+		self._lock = threading.Lock()
+
+	# call with the lock held
+	def _get(self, key, now):
+		entry = self._counts.get(key)
+		if entry is None or entry[1] <= now:
+			return 0
+		return entry[0]
+
+	def _incr(self, key, ttl, now):
+		if len(self._counts) >= self.max_keys:
+			self._counts = {k: v for k, v in self._counts.items() if v[1] > now}
+		count = self._get(key, now) + 1
+		self._counts[key] = (count, now + ttl)
+		return count
+
+	def hit(self, current, previous, limit, period, fraction):
+		now = time.monotonic()
+		with self._lock:
+			estimate = self._get(previous, now) * (1 - fraction) + self._get(current, now)
+			if estimate >= limit:
+				return False
+			self._incr(current, period * 2, now)
+			return True
+
+	def get(self, key):
+		with self._lock:
+			return self._get(key, time.monotonic())
+
+	def incr(self, key, ttl):
+		with self._lock:
+			return self._incr(key, ttl, time.monotonic())
+
+	def delete(self, key):
+		with self._lock:
+			self._counts.pop(key, None)
+
+
+_local = _LocalCounters()
+
+
+# the script is bound to the redis client of the app, registered once per app
+def init_app(app):
+	if app.config['STATE_BACKEND'] == 'redis':
+		app.extensions['ratelimit_script'] = redis_client.register_script(SLIDING_WINDOW)
+
+
+def _use_redis():
+	return current_app.config['STATE_BACKEND'] == 'redis'
+
+
+def _sliding_window():
+	return current_app.extensions['ratelimit_script']
+
+
+# count one hit for key, returns seconds to wait or 0 when the hit is allowed
+def hit(key, limit, period):
+	now = time.time()
+	window = int(now // period)
+	fraction = (now % period) / period
+	current, previous = f'rl:{key}:{window}', f'rl:{key}:{window - 1}'
+
+	allowed = None
+	if _use_redis():
+		try:
+			allowed = _sliding_window()(keys=[current, previous], args=[limit, period, fraction]) == 1
+		except redis.RedisError:
+			current_app.logger.warning('rate limit falling back to local counters, redis is unreachable')
+	if allowed is None:
+		allowed = _local.hit(current, previous, limit, period, fraction)
+
+	return 0 if allowed else max(1, math.ceil(period - now % period))
+
+
+def _too_many(retry_after, message="Too many requests, please try again later."):
+	response = jsonify({"error": message})
+	response.status_code = 429
+	response.headers['Retry-After'] = str(retry_after)
+	return response
+
+
+# ===============================================
+# declarative limit for a route
+#   key='ip'    per client address
+#   key='email' per email address, place it below validate_request_json to read email_stripped
+# the route name is part of the key so every route has its own budget
+def rate_limit(limit, period, key='ip'):
+	def decorator(f):
+		@wraps(f)
+		def inner(*args, **kwargs):
+			if current_app.config['RATELIMIT_ENABLED']:
+				if key == 'ip':
+					value = request.remote_addr
+				else:
+					value = str(kwargs.get(f'{key}_stripped', '')).lower()
+
+				retry_after = hit(f'{request.endpoint}:{key}:{value}', limit, period)
+				if retry_after:
+					return _too_many(retry_after)
+
+			return f(*args, **kwargs)
+		return inner
+	return decorator
+
+
+# ===============================================
+# account lock after repeated failed logins
+# checked before the user is loaded, so a locked account costs no database or bcrypt work.
+# Counted per email and client ip, so nobody can lock the owner out of their account from elsewhere,
+# guessing from many ips is still capped by the per email rate limit of the log in route
+def _failures_key(email):
+	return f'login-fail:{email.lower()}:{request.remote_addr}'
+
+
+# failed logins counted for this email from this client
+def login_failures(email):
+	key = _failures_key(email)
+	if _use_redis():
+		try:
+			return int(redis_client.get(key) or 0)
+		except redis.RedisError:
+			pass
+	return _local.get(key)
+
+
+def lock_response():
+	return _too_many(current_app.config['LOGIN_LOCK_SECONDS'], "Too many failed attempts, account locked. Please try again later.")
+
+
+# the counter expires LOGIN_LOCK_SECONDS after the last failure
+def register_failure(email):
+	key = _failures_key(email)
+	if _use_redis():
+		try:
+			pipe = redis_client.pipeline()
+			pipe.incr(key)
+			pipe.expire(key, current_app.config['LOGIN_LOCK_SECONDS'])
+			pipe.execute()
+			return
+		except redis.RedisError:
+			pass
+	_local.incr(key, current_app.config['LOGIN_LOCK_SECONDS'])
+
+
+def reset_failures(email):
+	key = _failures_key(email)
+	_local.delete(key)
+	if _use_redis():
+		try:
+			redis_client.delete(key)
+		except redis.RedisError:
+			pass
@@ -0,0 +1,203 @@
+import time
+import redis
+import threading
+from collections import OrderedDict
+from flask import current_app, jsonify
+from flaskapp import redis_client
+
+
+# ===============================================
+# revoked access tokens, checked by login_required
+# a token carries its jti and the version of its user when it was issued (ver),
+#   log out           denies the jti until the token expires
+#   password change   bumps the user's version, every older token is revoked
+# both entries only live as long as the tokens they revoke, so the state stays small.
+# A version is the time of the bump in milliseconds (at least the previous one + 1),
+# so it still grows when the key expired in between and the counting starts over.
+# backends share one interface: version / is_revoked / revoke_token / revoke_user
+# Without redis a token can't be checked, authenticated routes fail closed with 503 and Retry-After
+# instead of accepting a token that may have been revoked. Answers still cached are used meanwhile.
+
+
+VERSION_PREFIX = 'token:version:'
+
+
+# raised when the revocation state can't be read or written
+class RevocationUnavailable(Exception):
+	def __init__(self, retry_after):
+		super().__init__('Token revocation state is unreachable.')
+		self.retry_after = retry_after
+
+
+def _now_ms():
+	return int(time.time() * 1000)
+
+
+class RedisRevocationStore():
+	"""
+	Redis keys
+	  token:revoked:<jti>       set until the token expires
+	  token:version:<user id>   version, kept one token lifetime after its last bump
+	A check is one pipelined read of both keys. The answer is kept per jti in a small per process cache
+	for cache_ttl seconds, a revocation made by another process is seen once that runs out.
+	"""
+	# KEYS[1] version, ARGV[1] now in ms, ARGV[2] ttl
+	BUMP = """
+	local version = math.max(tonumber(redis.call('GET', KEYS[1]) or 0) + 1, tonumber(ARGV[1]))
+	redis.call('SET', KEYS[1], version, 'EX', ARGV[2])
+	return version
+	"""
+
+	def __init__(self, client, cache_size, cache_ttl, retry_after):
+		self.client = client
+		self.retry_after = retry_after
+		self.cache_size = cache_size
+		self.cache_ttl = cache_ttl
+		self._cache = OrderedDict()		# jti -> (expires, user id, revoked)
+		self._lock = threading.Lock()
+		self._bump = client.register_script(self.BUMP)
+
+	def version(self, user_id):
+		try:
+			return int(self.client.get(f'{VERSION_PREFIX}{user_id}') or 0)
+		except redis.RedisError:
+			raise RevocationUnavailable(self.retry_after)
+
+	def is_revoked(self, jti, user_id, version):
+		if jti is not None:
+			with self._lock:
+				entry = self._cache.get(jti)
+				if entry is not None and entry[0] > time.monotonic():
+					return entry[2]
+
+		pipe = self.client.pipeline(transaction=False)
+		pipe.get(f'{VERSION_PREFIX}{user_id}')
+		if jti is not None:
+			pipe.exists(f'token:revoked:{jti}')
+		try:
+			current, *denied = pipe.execute()
+		except redis.RedisError:
+			raise RevocationUnavailable(self.retry_after)
+		revoked = any(denied) or version < int(current or 0)
+
+		if jti is not None:
+			self._remember(jti, user_id, revoked)
+		return revoked
+
+	def revoke_token(self, jti, user_id, ttl):
+		try:
+			self.client.set(f'token:revoked:{jti}', 1, ex=max(ttl, 1))
+		except redis.RedisError:
+			raise RevocationUnavailable(self.retry_after)
+		self._remember(jti, user_id, True)
+
+	def revoke_user(self, user_id, ttl):
+		try:
+			self._bump(keys=[f'{VERSION_PREFIX}{user_id}'], args=[_now_ms(), ttl])
+		except redis.RedisError:
+			raise RevocationUnavailable(self.retry_after)
+		with self._lock:
+			for jti in [jti for jti, entry in self._cache.items() if entry[1] == user_id]:
+				del self._cache[jti]
+
+	def _remember(self, jti, user_id, revoked):
+		with self._lock:
+			self._cache[jti] = (time.monotonic() + self.cache_ttl, user_id, revoked)
+			self._cache.move_to_end(jti)
+			while len(self._cache) > self.cache_size:
+				self._cache.popitem(last=False)
+
+
+class MemoryRevocationStore():
+	"""
+	In-process store for single process deployments and tests.
+	Entries expire with the tokens they revoke, the oldest ones are evicted beyond max_size.
+	"""
+	def __init__(self, max_size):
+		self.max_size = max_size
+		self._revoked = OrderedDict()	# jti -> expires
+		self._versions = OrderedDict()	# user id -> [version, expires]
+		self._lock = threading.Lock()
+
+	def _version(self, user_id):
+		entry = self._versions.get(user_id)
+		if entry is None:
+			return 0
+		if entry[1] <= time.monotonic():
+			del self._versions[user_id]
+			return 0
+		return entry[0]
+
+	def version(self, user_id):
+		with self._lock:
+			return self._version(user_id)
+
+	def is_revoked(self, jti, user_id, version):
+		with self._lock:
+			expires = self._revoked.get(jti)
+			if expires is not None and expires <= time.monotonic():
+				del self._revoked[jti]
+				expires = None
+			return expires is not None or version < self._version(user_id)
+
+	def revoke_token(self, jti, user_id, ttl):
+		with self._lock:
+			self._revoked[jti] = time.monotonic() + ttl
+			while len(self._revoked) > self.max_size:
+				self._revoked.popitem(last=False)
+
+	def revoke_user(self, user_id, ttl):
+		with self._lock:
+			self._versions[user_id] = [max(self._version(user_id) + 1, _now_ms()), time.monotonic() + ttl]
+			self._versions.move_to_end(user_id)
+			while len(self._versions) > self.max_size:
+				self._versions.popitem(last=False)
+
+
+# ===============================================
+def init_app(app):
+	if app.config['STATE_BACKEND'] == 'memory':
+		store = MemoryRevocationStore(app.config['MEMORY_STATE_MAX_KEYS'])
+	else:
+		store = RedisRevocationStore(
+			redis_client,
+			app.config['REVOCATION_CACHE_SIZE'],
+			app.config['REVOCATION_CACHE_TTL'],
+			app.config['REVOCATION_RETRY_AFTER']
+		)
+	app.extensions['revocation'] = store
+	app.register_error_handler(RevocationUnavailable, _unavailable_response)
+
+
+def _unavailable_response(error):
+	response = jsonify({"error": "Service unavailable, please try again."})
+	response.status_code = 503
+	response.headers['Retry-After'] = str(error.retry_after)
+	return response
+
+
+def _store():
+	return current_app.extensions['revocation']
+
+
+# the version a new token of the user carries
+def version(user_id):
+	return _store().version(user_id)
+
+
+# claims of a verified token, tokens issued before jti and ver existed are checked by version only
+def is_revoked(claims):
+	return _store().is_revoked(claims.get('jti'), claims.get('id'), claims.get('ver', 0))
+
+
+# log out, the token is denied until it expires
+# a token without a jti can only be revoked together with all tokens of its user
+def revoke_token(claims):
+	if claims.get('jti') is None:
+		return revoke_user(claims.get('id'))
+	return _store().revoke_token(claims['jti'], claims.get('id'), int(claims['exp'] - time.time()) + 1)
+
+
+# log out everywhere, every token issued so far is revoked
+def revoke_user(user_id):
+	return _store().revoke_user(user_id, current_app.config['JWT_TIMEOUT'] * 60)
@@ -0,0 +1,67 @@
+import time
+import redis
+from flaskapp.metrics import observe
+
+
+class RedisClient():
+	"""
+	Shared redis connection pool, configured from REDIS_URL and REDIS_MAX_CONNECTIONS.
+	Attribute access is forwarded to the redis.Redis client so it can be used like one.
+	"""
+	def __init__(self, app=None):
+		self._client = None
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		self._client = self._create(app)
+
+	def _create(self, app):
+		pool = redis.ConnectionPool.from_url(
+			app.config['REDIS_URL'],
+			max_connections=app.config['REDIS_MAX_CONNECTIONS'],
+			decode_responses=True
+		)
+		client_class = TimedRedis if app.config['METRICS_ENABLED'] else redis.Redis
+		return client_class(connection_pool=pool)
+
+	# drop the connections a forked worker inherited, the pool object itself stays
+	# since lua scripts registered before the fork keep a reference to it
+	def after_fork(self):
+		if self._client is not None:
+			self._client.connection_pool.reset()
+
+	def __getattr__(self, name):
+		if self._client is None:
+			raise RuntimeError('redis_client is used before create_app() configured it.')
+		return getattr(self._client, name)
+
+
+class TimedRedis(redis.Redis):
+	"""Redis client reporting the duration of every command, a pipeline counts as one PIPELINE call."""
+	def execute_command(self, *args, **options):
+		begin = time.perf_counter()
+		failed = True
+		try:
+			result = super().execute_command(*args, **options)
+			failed = False
+			return result
+		finally:
+			observe('redis', str(args[0]).split(' ')[0].upper(), time.perf_counter() - begin, failed)
+
+	def pipeline(self, transaction=True, shard_hint=None):
+		pipe = super().pipeline(transaction, shard_hint)
+		execute = pipe.execute
+
+		def timed_execute(raise_on_error=True):
+			begin = time.perf_counter()
+			failed = True
+			try:
+				result = execute(raise_on_error)
+				failed = False
+				return result
+			finally:
+				observe('redis', 'PIPELINE', time.perf_counter() - begin, failed)
+
+		pipe.execute = timed_execute
+		return pipe
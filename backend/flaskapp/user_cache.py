@@ -0,0 +1,157 @@
+import json
+import time
+import redis
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+
+class UserCache():
+	"""
+	Two tier cache of the user resolved by login_required.
+	Tier 1 is a per-process LRU with a short TTL, tier 2 is Redis shared by all workers
+	(skipped with the memory state backend).
+	Entries are dropped from both tiers after a commit that updates or deletes the user,
+	other processes only see that once their short local TTL runs out.
+
+	Cached users are detached snapshots without the password hash,
+	query the row again before modifying it.
+	"""
+	FIELDS = ('id', 'username', 'email', 'date_created')
+
+	def __init__(self, redis_client, app=None):
+		self.redis = redis_client
+		self.enabled = True
+		self.size = 1024
+		self.local_ttl = 5
+		self.redis_ttl = 300
+		self.use_redis = True
+		self._local = OrderedDict()
+		self._lock = threading.Lock()
+		self.local_hits = 0
+		self.redis_hits = 0
+		self.misses = 0
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		from flaskapp import db
+		from flaskapp.db_models import User
+
+		self.enabled = app.config.get('USER_CACHE_ENABLED', True)
+		self.size = app.config.get('USER_CACHE_SIZE', 1024)
+		self.local_ttl = app.config.get('USER_CACHE_LOCAL_TTL', 5)
+		self.redis_ttl = app.config.get('USER_CACHE_TTL', 300)
+		# single process deployments keep the local tier only
+		self.use_redis = app.config.get('STATE_BACKEND', 'redis') == 'redis'
+
+		# collect changed users on flush, invalidate only once the change is committed
+		if not event.contains(User, 'after_update', self._on_change):
+			event.listen(User, 'after_update', self._on_change)
+			event.listen(User, 'after_delete', self._on_change)
+			event.listen(db.session, 'after_commit', self._on_commit)
+
+	# ===============================================
+	def get(self, user_id):
+		from flaskapp.db_models import User
+
+		if not self.enabled:
+			return User.query.filter_by(id=user_id).first()
+
+		fields = self._get_local(user_id)
+		if fields is not None:
+			self.local_hits += 1
+			return self._build(User, fields)
+
+		fields = self._get_redis(user_id)
+		if fields is not None:
+			self.redis_hits += 1
+			self._set_local(user_id, fields)
+			return self._build(User, fields)
+
+		self.misses += 1
+		user = User.query.filter_by(id=user_id).first()
+		if user:
+			fields = {name: getattr(user, name) for name in self.FIELDS}
+			fields['date_created'] = fields['date_created'].isoformat()
+			self._set_local(user_id, fields)
+			self._set_redis(user_id, fields)
+		return user
+
+	def invalidate(self, user_id):
+		with self._lock:
+			self._local.pop(user_id, None)
+		if not self.use_redis:
+			return
+		try:
+			self.redis.delete(self._key(user_id))
+		except redis.RedisError:
+			pass
+
+	def clear(self):
+		with self._lock:
+			self._local.clear()
+
+	def stats(self):
+		return {
+			'local_hits': self.local_hits,
+			'redis_hits': self.redis_hits,
+			'misses': self.misses,
+			'local_size': len(self._local),
+		}
+
+	# ===============================================
+	@staticmethod
+	def _key(user_id):
+		return f'user:{user_id}'
+
+	@staticmethod
+	def _build(User, fields):
+		fields = dict(fields)
+		fields['date_created'] = datetime.fromisoformat(fields['date_created'])
+		return User(**fields)
+
+	def _get_local(self, user_id):
+		with self._lock:
+			entry = self._local.get(user_id)
+			if entry is None:
+				return None
+			expires, fields = entry
+			if expires < time.monotonic():
+				del self._local[user_id]
+				return None
+			self._local.move_to_end(user_id)
+			return fields
+
+	def _set_local(self, user_id, fields):
+		with self._lock:
+			self._local[user_id] = (time.monotonic() + self.local_ttl, fields)
+			self._local.move_to_end(user_id)
+			while len(self._local) > self.size:
+				self._local.popitem(last=False)
+
+	def _get_redis(self, user_id):
+		if not self.use_redis:
+			return None
+		try:
+			raw = self.redis.get(self._key(user_id))
+		except redis.RedisError:
+			return None
+		return json.loads(raw) if raw else None
+
+	def _set_redis(self, user_id, fields):
+		if not self.use_redis:
+			return
+		try:
+			self.redis.setex(self._key(user_id), self.redis_ttl, json.dumps(fields))
+		except redis.RedisError:
+			pass
+
+	def _on_change(self, mapper, connection, target):
+		object_session(target).info.setdefault('changed_users', set()).add(target.id)
+
+	def _on_commit(self, session):
+		for user_id in session.info.pop('changed_users', ()):
+			self.invalidate(user_id)
@@ -0,0 +1,146 @@
+import math
+import redis
+import hashlib
+import threading
+from flask import current_app
+from flaskapp import redis_client
+
+
+# ===============================================
+# bloom filter of taken usernames and emails
+# "not in the filter" is a definite answer and needs no database query,
+# "maybe in the filter" falls through to the indexed exists check.
+# Bits are never cleared, deleted users only cost an extra query until the filter is rebuilt.
+# Without redis every lookup is a "maybe" answered by the database. A failed add marks the filter
+# stale, the next lookup of that process fills it again from the table once redis answers.
+# flask --app run users rebuild-bloom does the same by hand, e.g. after a worker died in between.
+
+class _LocalBits():
+	def __init__(self, size):
+		self.bits = bytearray((size + 7) // 8)
+		self.ready = False
+
+	def set(self, offsets):
+		for offset in offsets:
+			self.bits[offset >> 3] |= 1 << (offset & 7)
+
+	def get(self, groups):
+		return [all(self.bits[offset >> 3] & (1 << (offset & 7)) for offset in offsets) for offsets in groups]
+
+	def is_ready(self):
+		return self.ready
+
+	def mark_ready(self):
+		self.ready = True
+
+
+class _RedisBits():
+	"""Bitmap shared by every worker, each call is one pipelined round trip."""
+	# the key carries the filter geometry so a config change starts a fresh bitmap
+	def __init__(self, size, hashes):
+		self.key = f'bloom:users:{size}:{hashes}'
+		self.ready_key = f'{self.key}:ready'
+		self.ready = False
+
+	def set(self, offsets):
+		pipe = redis_client.pipeline(transaction=False)
+		for offset in offsets:
+			pipe.setbit(self.key, offset, 1)
+		pipe.execute()
+
+	def get(self, groups):
+		pipe = redis_client.pipeline(transaction=False)
+		for offsets in groups:
+			for offset in offsets:
+				pipe.getbit(self.key, offset)
+		bits = iter(pipe.execute())
+		return [all([next(bits) for _ in offsets]) for offsets in groups]
+
+	# once seen ready it stays ready, no round trip per request
+	def is_ready(self):
+		if not self.ready:
+			self.ready = bool(redis_client.exists(self.ready_key))
+		return self.ready
+
+	def mark_ready(self):
+		redis_client.set(self.ready_key, 1)
+		self.ready = True
+
+
+class UserBloom():
+	def __init__(self, capacity, error_rate, shared):
+		# optimal size and number of hashes for the wanted false positive rate,
+		# every user is two entries, its name and its email
+		entries = 2 * capacity
+		self.size = int(-entries * math.log(error_rate) / math.log(2) ** 2)
+		self.hashes = max(1, round(self.size / entries * math.log(2)))
+		self.bits = _RedisBits(self.size, self.hashes) if shared else _LocalBits(self.size)
+		self.stale = False
+		self._lock = threading.Lock()
+
+	# k bit offsets from two 64 bit hashes (double hashing)
+	def _offsets(self, item):
+		digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+		h1 = int.from_bytes(digest[:8], 'little')
+		h2 = int.from_bytes(digest[8:], 'little') | 1
+		return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+	# fill the filter from the user table once, later inserts are added by verify()
+	def ensure_built(self):
+		if self.bits.is_ready() and not self.stale:
+			return
+		with self._lock:
+			if self.bits.is_ready() and not self.stale:
+				return
+			self.rebuild()
+
+	# set the bits of every user again, bits are only added so lookups stay correct meanwhile
+	def rebuild(self):
+		from flaskapp import db
+		from flaskapp.db_models import User
+		# cleared first, an add failing during the fill marks it stale again
+		self.stale = False
+		rows = db.session.execute(db.select(User.username, User.email_normalized)).yield_per(1000)
+		for partition in rows.partitions():
+			self._set(partition)
+		self.bits.mark_ready()
+
+	def add_user(self, username, email):
+		self.add_users([(username, email)])
+
+	# many (username, email) pairs in one call, for the bulk import
+	# a user missing from the filter would read as available, a failed add refills it on the next lookup
+	def add_users(self, users):
+		try:
+			self._set(users)
+		except redis.RedisError as e:
+			self.stale = True
+			current_app.logger.warning(f'user bloom filter not updated, redis is unreachable: {e!r}')
+
+	def _set(self, users):
+		offsets = []
+		for username, email in users:
+			offsets += self._offsets(f'name:{username}') + self._offsets(f'email:{email}')
+		self.bits.set(offsets)
+
+	# items are already normalized, returns one bool per item
+	def might_contain(self, items):
+		try:
+			self.ensure_built()
+			return self.bits.get([self._offsets(item) for item in items])
+		except redis.RedisError:
+			current_app.logger.warning('user bloom filter skipped, redis is unreachable')
+			return [True] * len(items)
+
+
+# ===============================================
+def init_app(app):
+	app.extensions['user_bloom'] = UserBloom(
+		app.config['USER_BLOOM_CAPACITY'],
+		app.config['USER_BLOOM_ERROR_RATE'],
+		shared=app.config['STATE_BACKEND'] == 'redis'
+	)
+
+
+def get_bloom():
+	return current_app.extensions['user_bloom']
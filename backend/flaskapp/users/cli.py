@@ -0,0 +1,276 @@
+import os
+import sys
+import csv
+import json
+import time
+import click
+import multiprocessing
+from datetime import datetime
+from itertools import islice, repeat
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from flaskapp import db, hasher
+from flask import current_app
+from sqlalchemy import inspect, text, func, select, Table, MetaData, Column, String, Index
+from sqlalchemy.exc import IntegrityError
+from flaskapp.db_models import User
+from flaskapp.hashing import hash_password
+from flaskapp.users.bloom import get_bloom
+from flaskapp.users.routes import users_bp
+from flaskapp.utils import EMAIL_REGEX, MIN_NAME_LENGTH, MIN_PASS_LENGTH, MAX_PASS_LENGTH, PASSWORD_REGEX
+
+
+# =================================================================
+# flask --app run users add-email-index
+# databases created before User.email_normalized existed need the column added and filled once,
+# the same run widens email from 30 to 254 characters. Safe to run again.
+@users_bp.cli.command('add-email-index')
+def add_email_index():
+	"""Add, fill and index the lowercased email column of the user table."""
+	engine = db.engine
+	quote = engine.dialect.identifier_preparer.quote
+	columns = {column['name']: column for column in inspect(engine).get_columns('user')}
+
+	# only the columns used here, the model's table would also create its own unique constraint
+	table = Table('user', MetaData(), Column('email', String(254)), Column('email_normalized', String(254)))
+
+	with engine.begin() as conn:
+		if 'email_normalized' not in columns:
+			conn.execute(text(f'ALTER TABLE {quote("user")} ADD COLUMN email_normalized VARCHAR(254)'))
+
+		# sqlite doesn't enforce varchar lengths
+		if getattr(columns['email']['type'], 'length', None) not in (None, 254):
+			if engine.dialect.name == 'postgresql':
+				conn.execute(text(f'ALTER TABLE {quote("user")} ALTER COLUMN email TYPE VARCHAR(254)'))
+			elif engine.dialect.name in ('mysql', 'mariadb'):
+				conn.execute(text(f'ALTER TABLE {quote("user")} MODIFY email VARCHAR(254) NOT NULL'))
+
+		conn.execute(table.update().values(email_normalized=func.lower(func.trim(table.c.email))))
+
+		# emails that only differ by case can't share the unique index
+		duplicates = conn.execute(
+			select(table.c.email_normalized).group_by(table.c.email_normalized).having(func.count() > 1)
+		).scalars().all()
+		if duplicates:
+			raise click.ClickException(f'Emails differing only by case, fix them first: {", ".join(duplicates)}')
+
+		# a database created with the column already has its unique constraint
+		inspector = inspect(conn)
+		unique = inspector.get_unique_constraints('user') + [index for index in inspector.get_indexes('user') if index['unique']]
+		if not any(entry['column_names'] == ['email_normalized'] for entry in unique):
+			Index('ix_user_email_normalized', table.c.email_normalized, unique=True).create(conn, checkfirst=True)
+
+	click.echo('email_normalized is filled and indexed.')
+
+
+# =================================================================
+# flask --app run users rebuild-bloom
+# sets the bits of every user again, after redis lost the bitmap or a worker died with a failed add
+@users_bp.cli.command('rebuild-bloom')
+def rebuild_bloom():
+	"""Fill the shared user bloom filter from the user table again."""
+	if current_app.config['STATE_BACKEND'] != 'redis':
+		raise click.ClickException('The memory backend builds its filter in every process, restart them instead.')
+	started = time.perf_counter()
+	get_bloom().rebuild()
+	click.echo(f'user bloom filter rebuilt in {time.perf_counter() - started:.1f}s')
+
+
+# =================================================================
+# bulk import and export, the file is streamed so memory stays flat whatever its size
+#   flask --app run users import users.csv [--passwords auto|hashed|plain] [--workers 8]
+#   flask --app run users export users.jsonl
+# csv has a header line, jsonl one object per line, both with username, email, password
+# and optionally date_created (iso format). The format comes from the extension, - is stdin / stdout.
+# An export includes the bcrypt hashes, so it imports again without hashing anything.
+
+EXPORT_FIELDS = ['username', 'email', 'password', 'date_created']
+BCRYPT_PREFIXES = ('$2a$', '$2b$', '$2y$')
+PROGRESS_EVERY = 100000		# exported rows between two progress lines
+
+
+def _format(path, fmt):
+	if fmt:
+		return fmt
+	return 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def _open(path, mode):
+	if path == '-':
+		return nullcontext(sys.stdin if mode == 'r' else sys.stdout)
+	return open(path, mode, newline='', encoding='utf-8')
+
+
+def _report(action, count, started):
+	seconds = max(time.perf_counter() - started, 1e-9)
+	click.echo(f'{count} users {action} in {seconds:.1f}s, {count / seconds:.0f} rows/s', err=True)
+
+
+# (line number, record) one at a time
+def _read_records(f, fmt):
+	if fmt == 'jsonl':
+		for number, line in enumerate(f, 1):
+			if not line.strip():
+				continue
+			try:
+				yield number, json.loads(line)
+			except ValueError:
+				raise click.ClickException(f'line {number}: not valid json.')
+	else:
+		reader = csv.DictReader(f)
+		for record in reader:
+			yield reader.line_num, record
+
+
+# record -> (line number, row of the user table, whether the password still has to be hashed)
+def _to_row(number, record, passwords, now):
+	try:
+		username = User.normalize_name(record['username'])
+		email = record['email'].strip()
+		password = record['password']
+		date_created = datetime.fromisoformat(record['date_created']) if record.get('date_created') else now
+	except (KeyError, AttributeError, TypeError):
+		raise click.ClickException(f'line {number}: username, email and password are required.')
+	except ValueError:
+		raise click.ClickException(f'line {number}: date_created is not an iso date.')
+
+	columns = User.__table__.c
+	if not MIN_NAME_LENGTH <= len(username) <= columns.username.type.length:
+		raise click.ClickException(f'line {number}: username must be {MIN_NAME_LENGTH} to {columns.username.type.length} characters.')
+	if len(email) > columns.email.type.length or not EMAIL_REGEX.match(email):
+		raise click.ClickException(f'line {number}: invalid email {email!r}.')
+	if not isinstance(password, str) or not password:
+		raise click.ClickException(f'line {number}: password is empty.')
+
+	hashed = password.startswith(BCRYPT_PREFIXES) and len(password) == 60
+	if passwords == 'hashed' and not hashed:
+		raise click.ClickException(f'line {number}: password is not a bcrypt hash.')
+	needs_hash = passwords == 'plain' or not hashed
+
+	# the rules of sign up, a password log in rejects could never be used
+	if needs_hash:
+		password = password.strip()
+		if not MIN_PASS_LENGTH <= len(password) <= MAX_PASS_LENGTH or not PASSWORD_REGEX.match(password):
+			raise click.ClickException(
+				f'line {number}: password must be {MIN_PASS_LENGTH} to {MAX_PASS_LENGTH} letters and digits '
+				'with a lowercase letter, an uppercase letter and a digit.'
+			)
+
+	row = {
+		'username': username,
+		'email': email,
+		'email_normalized': User.normalize_email(email),
+		'password': password,
+		'date_created': date_created,
+	}
+	return number, row, needs_hash
+
+
+def _batches(items, size):
+	items = iter(items)
+	while batch := list(islice(items, size)):
+		yield batch
+
+
+# (last line number, rows) with every password hashed. The pool hashes the next batch
+# while the current one is written, workers = 0 hashes inline.
+def _hash_batches(batches, executor, rounds, workers):
+	def resolve(batch, hashes):
+		for (_, row, _), hashed in zip([item for item in batch if item[2]], hashes):
+			row['password'] = hashed
+		return batch[-1][0], [row for _, row, _ in batch]
+
+	pending = None
+	for batch in batches:
+		plain = [row['password'] for _, row, needs_hash in batch if needs_hash]
+		if executor is None:
+			yield resolve(batch, [hash_password(password, rounds) for password in plain])
+			continue
+		# map submits the whole batch at once, the results are collected by resolve
+		chunksize = max(1, len(plain) // (workers * 4))
+		hashes = executor.map(hash_password, plain, repeat(rounds), chunksize=chunksize)
+		if pending is not None:
+			yield resolve(*pending)
+		pending = (batch, hashes)
+	if pending is not None:
+		yield resolve(*pending)
+
+
+@users_bp.cli.command('import')
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='default from the file extension, csv otherwise')
+@click.option('--passwords', type=click.Choice(['auto', 'hashed', 'plain']), default='auto', help='auto keeps bcrypt hashes and hashes the rest')
+@click.option('--batch-size', type=int, default=1000, help='rows per executemany insert')
+@click.option('--commit-every', type=int, default=10000, help='rows per transaction')
+@click.option('--workers', type=int, default=os.cpu_count(), help='hashing processes, 0 hashes inline')
+def import_users(path, fmt, passwords, batch_size, commit_every, workers):
+	"""Import users from a csv or jsonl file."""
+	fmt = _format(path, fmt)
+	bloom = get_bloom()
+	bloom_ready = bloom.bits.is_ready()
+	executor = None
+	if workers:
+		executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+	started = time.perf_counter()
+	imported = committed = 0
+	try:
+		with _open(path, 'r') as f:
+			now = datetime.utcnow()
+			items = (_to_row(number, record, passwords, now) for number, record in _read_records(f, fmt))
+			for last_line, rows in _hash_batches(_batches(items, batch_size), executor, hasher.rounds, workers):
+				try:
+					db.session.execute(User.__table__.insert(), rows)
+				except IntegrityError as e:
+					raise click.ClickException(f'a user up to line {last_line} already exists: {e.orig}')
+				imported += len(rows)
+
+				# a filter that is not built yet reads the new users from the table when it is
+				if bloom_ready:
+					bloom.add_users((row['username'], row['email_normalized']) for row in rows)
+
+				if imported - committed >= commit_every:
+					db.session.commit()
+					committed = imported
+					_report('imported', committed, started)
+			db.session.commit()
+	except click.ClickException:
+		db.session.rollback()
+		click.echo(f'{committed} users were imported before the error.', err=True)
+		raise
+	finally:
+		if executor is not None:
+			executor.shutdown(cancel_futures=True)
+
+	_report('imported', imported, started)
+
+
+@users_bp.cli.command('export')
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='default from the file extension, csv otherwise')
+@click.option('--batch-size', type=int, default=1000, help='rows fetched per round trip')
+@click.option('--without-passwords', is_flag=True, help='leave the password hashes out')
+def export_users(path, fmt, batch_size, without_passwords):
+	"""Export users to a csv or jsonl file."""
+	fmt = _format(path, fmt)
+	fields = [field for field in EXPORT_FIELDS if not (without_passwords and field == 'password')]
+	# yield_per streams the result with a server side cursor, only one batch of rows is held at a time
+	query = db.select(*[getattr(User, field) for field in fields]).order_by(User.id).execution_options(yield_per=batch_size)
+
+	started = time.perf_counter()
+	exported = 0
+	with _open(path, 'w') as f:
+		if fmt == 'csv':
+			writer = csv.writer(f)
+			writer.writerow(fields)
+		for row in db.session.execute(query):
+			values = [value.isoformat() if isinstance(value, datetime) else value for value in row]
+			if fmt == 'csv':
+				writer.writerow(values)
+			else:
+				f.write(json.dumps(dict(zip(fields, values))) + '\n')
+			exported += 1
+			if exported % PROGRESS_EVERY == 0:
+				_report('exported', exported, started)
+
+	_report('exported', exported, started)
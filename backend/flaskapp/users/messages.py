@@ -1,14 +1,162 @@
-from flaskapp import mail
-from flask_mail import Message
+import time
+import smtplib
+import threading
+from flaskapp.metrics import observe
+from flask import current_app
+from flask_mail import Message, Connection
 
-def send_otp(otp, email):
+# build the otp email
+def otp_message(otp, email):
 	msg = Message('Verify Your OTP', sender='noreply@demo.com', recipients=[email])
 	msg.body = f'''To confirm your email, Use the OTP. After 2 minutes otp will be invalid.
 OTP: {otp}
 If you did not make this request then simply ignore this email and no changes will be made.
 '''
-	try:
-		mail.send(msg)
+	return msg
+
+
+# ===============================================
+# the server hung up or the socket broke, retrying on a new connection can help
+# smtplib errors are OSErrors too, but a refused recipient will not be fixed by reconnecting
+def _disconnected(error):
+	if isinstance(error, smtplib.SMTPServerDisconnected):
 		return True
-	except:
-		return False
\ No newline at end of file
+	return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+class SMTPPool():
+	"""
+	Keeps authenticated Flask-Mail connections open and reuses them across messages.
+	A connection idle for longer than SMTP_IDLE_TIMEOUT is closed instead of reused,
+	one idle for longer than SMTP_CHECK_AFTER is checked with NOOP first.
+	A send that fails because the server hung up is retried once on a fresh connection.
+	"""
+	def __init__(self):
+		self._idle = []
+		self._lock = threading.Lock()
+		self.connects = 0
+		self.reuses = 0
+		self.sends = 0
+		self.failures = 0
+		self.send_total = 0.0
+		self.send_max = 0.0
+
+	def send(self, msg):
+		error = self.send_many([msg])[0]
+		if error is not None:
+			raise error
+
+	# send several messages over one session, returns one exception or None per message
+	def send_many(self, messages):
+		results = []
+		conn = self._acquire()
+		for msg in messages:
+			conn, error = self._send(conn, msg)
+			results.append(error)
+		if conn is not None:
+			self._release(conn)
+		return results
+
+	def close(self):
+		with self._lock:
+			idle, self._idle = self._idle, []
+		for _, conn in idle:
+			self._quit(conn)
+
+	def stats(self):
+		sends = self.sends or 1
+		return {
+			'connects': self.connects,
+			'reuses': self.reuses,
+			'sends': self.sends,
+			'failures': self.failures,
+			'send_avg_ms': round(self.send_total / sends * 1000, 3),
+			'send_max_ms': round(self.send_max * 1000, 3),
+		}
+
+	# ===============================================
+	def _send(self, conn, msg):
+		for attempt in range(2):
+			begin = None
+			try:
+				if conn is None:
+					conn = self._connect()
+				begin = time.perf_counter()
+				conn.send(msg)
+			except Exception as e:
+				# a failed connect is already recorded by _connect
+				if begin is not None:
+					observe('smtp', 'send', time.perf_counter() - begin, failed=True)
+				if conn is not None and _disconnected(e):
+					self._quit(conn)
+					conn = None
+				if attempt or not _disconnected(e):
+					self.failures += 1
+					return conn, e
+				continue
+
+			elapsed = time.perf_counter() - begin
+			self.sends += 1
+			self.send_total += elapsed
+			self.send_max = max(self.send_max, elapsed)
+			observe('smtp', 'send', elapsed)
+			return conn, None
+
+	def _connect(self):
+		begin = time.perf_counter()
+		conn = Connection(current_app.extensions['mail'])
+		try:
+			conn.host = None if conn.mail.suppress else conn.configure_host()
+		except Exception:
+			observe('smtp', 'connect', time.perf_counter() - begin, failed=True)
+			raise
+		observe('smtp', 'connect', time.perf_counter() - begin)
+		self.connects += 1
+		return conn
+
+	def _acquire(self):
+		config = current_app.config
+		while True:
+			with self._lock:
+				if not self._idle:
+					break
+				last_used, conn = self._idle.pop()
+
+			idle_for = time.monotonic() - last_used
+			if idle_for > config['SMTP_IDLE_TIMEOUT'] or (idle_for > config['SMTP_CHECK_AFTER'] and not self._alive(conn)):
+				self._quit(conn)
+				continue
+
+			self.reuses += 1
+			return conn
+
+		# no idle connection, _send opens one for the first message
+		return None
+
+	def _release(self, conn):
+		with self._lock:
+			if len(self._idle) < current_app.config['SMTP_POOL_SIZE']:
+				self._idle.append((time.monotonic(), conn))
+				return
+		self._quit(conn)
+
+	@staticmethod
+	def _alive(conn):
+		if conn.host is None:
+			return True
+		try:
+			return conn.host.noop()[0] == 250
+		except (smtplib.SMTPException, OSError):
+			return False
+
+	@staticmethod
+	def _quit(conn):
+		if conn.host is None:
+			return
+		try:
+			conn.host.quit()
+		except (smtplib.SMTPException, OSError):
+			conn.host.close()
+
+
+smtp_pool = SMTPPool()
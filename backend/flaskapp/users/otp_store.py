@@ -0,0 +1,148 @@
+import time
+import threading
+from collections import OrderedDict
+from flask import current_app
+from flaskapp import redis_client
+
+
+# ===============================================
+# backends share one interface: issue / verify / consume / release
+# STATE_BACKEND picks the one used by the app
+
+class RedisOTPStore():
+	"""
+	Every operation is a single redis round trip and atomic on the server.
+	Otps are stored in a hash under otp:<lowercased email> with the code and the number of wrong guesses.
+	"""
+	# ARGV[1] otp, ARGV[2] ttl
+	ISSUE = """
+	if redis.call('EXISTS', KEYS[1]) == 1 then
+		return 0
+	end
+	redis.call('HSET', KEYS[1], 'code', ARGV[1], 'tries', 0)
+	redis.call('EXPIRE', KEYS[1], ARGV[2])
+	return 1
+	"""
+
+	# ARGV[1] otp, ARGV[2] max wrong guesses, ARGV[3] '1' to delete the otp on a match
+	# after too many wrong guesses the code is removed but the key stays until it expires,
+	# so the otp is dead and a new one can't be issued before the ttl runs out
+	CHECK = """
+	local code = redis.call('HGET', KEYS[1], 'code')
+	if not code then
+		return 0
+	end
+	if code == ARGV[1] then
+		if ARGV[3] == '1' then
+			redis.call('DEL', KEYS[1])
+		end
+		return 1
+	end
+	if redis.call('HINCRBY', KEYS[1], 'tries', 1) >= tonumber(ARGV[2]) then
+		redis.call('HDEL', KEYS[1], 'code')
+	end
+	return 0
+	"""
+
+	def __init__(self, client, max_attempts):
+		self.client = client
+		self.max_attempts = max_attempts
+		self._issue = client.register_script(self.ISSUE)
+		self._check = client.register_script(self.CHECK)
+
+	@staticmethod
+	def _key(email):
+		return f'otp:{email.lower()}'
+
+	def issue(self, email, otp, ttl):
+		return self._issue(keys=[self._key(email)], args=[otp, ttl]) == 1
+
+	def verify(self, email, otp):
+		return self._check(keys=[self._key(email)], args=[otp, self.max_attempts, 0]) == 1
+
+	def consume(self, email, otp):
+		return self._check(keys=[self._key(email)], args=[otp, self.max_attempts, 1]) == 1
+
+
+class MemoryOTPStore():
+	"""
+	In-process store for single process deployments and tests.
+	Entries expire after their ttl, the oldest ones are evicted beyond max_size.
+	"""
+	def __init__(self, max_size, max_attempts):
+		self.max_size = max_size
+		self.max_attempts = max_attempts
+		self._data = OrderedDict()
+		self._lock = threading.Lock()
+
+	# live entry [code, expires, tries], None if missing or expired, call with the lock held
+	def _get(self, email):
+		entry = self._data.get(email)
+		if entry is None:
+			return None
+		if entry[1] <= time.monotonic():
+			del self._data[email]
+			return None
+		return entry
+
+	def issue(self, email, otp, ttl):
+		email = email.lower()
+		with self._lock:
+			if self._get(email) is not None:
+				return False
+			self._data[email] = [otp, time.monotonic() + ttl, 0]
+			while len(self._data) > self.max_size:
+				self._data.popitem(last=False)
+			return True
+
+	def _check(self, email, otp, consume):
+		email = email.lower()
+		with self._lock:
+			entry = self._get(email)
+			if entry is None or entry[0] is None:
+				return False
+			if entry[0] == otp:
+				if consume:
+					del self._data[email]
+				return True
+			entry[2] += 1
+			if entry[2] >= self.max_attempts:
+				entry[0] = None
+			return False
+
+	def verify(self, email, otp):
+		return self._check(email, otp, False)
+
+	def consume(self, email, otp):
+		return self._check(email, otp, True)
+
+
+# ===============================================
+def init_app(app):
+	if app.config['STATE_BACKEND'] == 'memory':
+		store = MemoryOTPStore(app.config['MEMORY_STATE_MAX_KEYS'], app.config['OTP_MAX_ATTEMPTS'])
+	else:
+		store = RedisOTPStore(redis_client, app.config['OTP_MAX_ATTEMPTS'])
+	app.extensions['otp_store'] = store
+
+
+def _store():
+	return current_app.extensions['otp_store']
+
+
+# reserve an otp for the email, False while a previous one is still valid
+def issue(email, otp):
+	return _store().issue(email, otp, current_app.config['OTP_TTL'])
+
+
+def verify(email, otp):
+	return _store().verify(email, otp)
+
+
+def consume(email, otp):
+	return _store().consume(email, otp)
+
+
+# undo a reservation whose email could not be queued
+def release(email, otp):
+	return _store().consume(email, otp)
@@ -0,0 +1,237 @@
+import json
+import time
+import uuid
+import queue
+import redis
+import threading
+from collections import OrderedDict
+from flask import current_app
+from flaskapp import redis_client
+from flaskapp.users.messages import otp_message, smtp_pool
+
+
+# ===============================================
+# Redis keys
+#   outbox:queue                  list of jobs waiting for a worker
+#   outbox:delayed                sorted set of jobs waiting for a retry, scored by due time
+#   outbox:processing:<worker>    jobs a worker has taken but not finished
+#   outbox:status:<id>            hash with the delivery status of one message
+QUEUE_KEY = 'outbox:queue'
+DELAYED_KEY = 'outbox:delayed'
+PROCESSING_KEY = 'outbox:processing:{}'
+STATUS_KEY = 'outbox:status:{}'
+
+QUEUED = 'queued'
+SENDING = 'sending'
+RETRYING = 'retrying'
+SENT = 'sent'
+FAILED = 'failed'
+
+
+# ===============================================
+# with STATE_BACKEND = 'memory' the emails are delivered by a thread of this process
+def init_app(app):
+	if app.config['STATE_BACKEND'] == 'memory':
+		app.extensions['outbox'] = LocalOutbox(app)
+
+
+# push an otp email onto the outbox, returns the message id or None if redis is down
+def enqueue_otp(otp, email):
+	job = {'id': uuid.uuid4().hex, 'kind': 'otp', 'otp': otp, 'email': email, 'attempts': 0}
+	if 'outbox' in current_app.extensions:
+		return current_app.extensions['outbox'].enqueue(job)
+
+	try:
+		pipe = redis_client.pipeline()
+		_set_status(pipe, job['id'], QUEUED, 0)
+		pipe.lpush(QUEUE_KEY, json.dumps(job))
+		pipe.execute()
+	except redis.RedisError:
+		return None
+	return job['id']
+
+
+# delivery status of a message, None if unknown or expired
+def get_status(message_id):
+	if 'outbox' in current_app.extensions:
+		return current_app.extensions['outbox'].get_status(message_id)
+
+	status = redis_client.hgetall(STATUS_KEY.format(message_id))
+	if not status:
+		return None
+	status['attempts'] = int(status['attempts'])
+	return status
+
+
+# ===============================================
+# worker side
+def build_message(job):
+	if job['kind'] == 'otp':
+		return otp_message(job['otp'], job['email'])
+	raise ValueError(f"Unknown outbox job kind: {job['kind']}")
+
+
+# send a batch of jobs over one pooled smtp session, returns one exception or None per job
+def deliver(jobs):
+	messages, results = [], [None] * len(jobs)
+	for i, job in enumerate(jobs):
+		try:
+			messages.append((i, build_message(job)))
+		except Exception as e:
+			results[i] = e
+
+	errors = smtp_pool.send_many([msg for _, msg in messages])
+	for (i, _), error in zip(messages, errors):
+		results[i] = error
+	return results
+
+
+# move retries whose backoff has elapsed back onto the queue
+def promote_delayed(now=None):
+	now = time.time() if now is None else now
+	for raw in redis_client.zrangebyscore(DELAYED_KEY, '-inf', now):
+		# only the worker that removes the job requeues it
+		if redis_client.zrem(DELAYED_KEY, raw):
+			redis_client.lpush(QUEUE_KEY, raw)
+
+
+# put back jobs a crashed worker with the same name left behind
+def recover(worker_name):
+	processing = PROCESSING_KEY.format(worker_name)
+	count = 0
+	while redis_client.lmove(processing, QUEUE_KEY, 'RIGHT', 'LEFT'):
+		count += 1
+	return count
+
+
+# take the pending jobs (up to OUTBOX_BATCH_SIZE) and deliver them together
+# returns the number of jobs handled, 0 when the queue stayed empty for timeout seconds
+def process_batch(worker_name, timeout=1):
+	processing = PROCESSING_KEY.format(worker_name)
+	raw = redis_client.blmove(QUEUE_KEY, processing, timeout, 'RIGHT', 'LEFT')
+	if raw is None:
+		return 0
+
+	batch = [raw]
+	while len(batch) < current_app.config['OUTBOX_BATCH_SIZE']:
+		raw = redis_client.lmove(QUEUE_KEY, processing, 'RIGHT', 'LEFT')
+		if raw is None:
+			break
+		batch.append(raw)
+
+	jobs = [json.loads(raw) for raw in batch]
+	for job in jobs:
+		job['attempts'] += 1
+		_set_status(redis_client, job['id'], SENDING, job['attempts'])
+
+	for raw, job, error in zip(batch, jobs, deliver(jobs)):
+		if error is None:
+			_set_status(redis_client, job['id'], SENT, job['attempts'])
+		else:
+			_retry_or_fail(job, repr(error))
+		redis_client.lrem(processing, 1, raw)
+
+	return len(batch)
+
+
+def run_worker(worker_name, stop=None):
+	recovered = recover(worker_name)
+	current_app.logger.info(f'outbox worker {worker_name} started, recovered {recovered} jobs')
+
+	try:
+		while not (stop and stop.is_set()):
+			try:
+				promote_delayed()
+				process_batch(worker_name)
+			except redis.RedisError as e:
+				current_app.logger.warning(f'outbox worker {worker_name}: {e!r}')
+				time.sleep(1)
+	finally:
+		smtp_pool.close()
+
+
+# ===============================================
+def _retry_or_fail(job, error):
+	max_attempts = current_app.config['OUTBOX_MAX_ATTEMPTS']
+	if job['attempts'] >= max_attempts:
+		_set_status(redis_client, job['id'], FAILED, job['attempts'], error)
+		return
+
+	delay = _backoff(job)
+	redis_client.zadd(DELAYED_KEY, {json.dumps(job): time.time() + delay})
+	_set_status(redis_client, job['id'], RETRYING, job['attempts'], error)
+
+
+# exponential backoff, 2s, 4s, 8s ... with the default base
+def _backoff(job):
+	return current_app.config['OUTBOX_BACKOFF'] * 2 ** (job['attempts'] - 1)
+
+
+def _set_status(client, message_id, state, attempts, error=''):
+	key = STATUS_KEY.format(message_id)
+	client.hset(key, mapping={'state': state, 'attempts': attempts, 'error': error, 'updated': time.time()})
+	client.expire(key, current_app.config['OUTBOX_STATUS_TTL'])
+
+
+# ===============================================
+class LocalOutbox():
+	"""
+	In-process outbox for single process deployments, a daemon thread delivers the emails
+	with the same batching and retry policy as worker.py. Jobs are lost when the process exits.
+	"""
+	def __init__(self, app):
+		self.app = app
+		self.max_status = app.config['MEMORY_STATE_MAX_KEYS']
+		self._queue = queue.Queue()
+		self._status = OrderedDict()
+		self._lock = threading.Lock()
+		self._thread = None
+
+	def enqueue(self, job):
+		self._set_status(job['id'], QUEUED, 0)
+		self._start()
+		self._queue.put(job)
+		return job['id']
+
+	def get_status(self, message_id):
+		with self._lock:
+			status = self._status.get(message_id)
+			return dict(status) if status else None
+
+	def _start(self):
+		with self._lock:
+			if self._thread is None or not self._thread.is_alive():
+				self._thread = threading.Thread(target=self._run, name='outbox', daemon=True)
+				self._thread.start()
+
+	def _run(self):
+		with self.app.app_context():
+			while True:
+				jobs = [self._queue.get()]
+				while len(jobs) < current_app.config['OUTBOX_BATCH_SIZE']:
+					try:
+						jobs.append(self._queue.get_nowait())
+					except queue.Empty:
+						break
+
+				for job in jobs:
+					job['attempts'] += 1
+					self._set_status(job['id'], SENDING, job['attempts'])
+
+				for job, error in zip(jobs, deliver(jobs)):
+					if error is None:
+						self._set_status(job['id'], SENT, job['attempts'])
+					elif job['attempts'] >= current_app.config['OUTBOX_MAX_ATTEMPTS']:
+						self._set_status(job['id'], FAILED, job['attempts'], repr(error))
+					else:
+						self._set_status(job['id'], RETRYING, job['attempts'], repr(error))
+						timer = threading.Timer(_backoff(job), self._queue.put, args=[job])
+						timer.daemon = True
+						timer.start()
+
+	def _set_status(self, message_id, state, attempts, error=''):
+		with self._lock:
+			self._status[message_id] = {'state': state, 'attempts': attempts, 'error': error, 'updated': time.time()}
+			self._status.move_to_end(message_id)
+			while len(self._status) > self.max_status:
+				self._status.popitem(last=False)
@@ -0,0 +1,204 @@
+import time
+import uuid
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+from flask import current_app
+from flaskapp import redis_client
+from flaskapp.revocation import VERSION_PREFIX
+
+
+# ===============================================
+# opaque rotating refresh tokens, only a sha256 of the token is stored
+# every token belongs to a family started by one log in, a refresh marks the token used and
+# hands out the next one of the family. A used token presented again means it was copied,
+# the whole family is revoked and that device has to log in again.
+# backends share one interface: issue / rotate / revoke / revoke_user
+
+ROTATED = 1
+INVALID = 0
+REUSED = -1
+
+
+def _digest(token):
+	return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _new_token():
+	return secrets.token_urlsafe(32)
+
+
+class RedisRefreshStore():
+	"""
+	Redis keys
+	  refresh:<digest>            hash with the user, the family and whether the token was used
+	  refresh:family:<family>     exists while the family is valid
+	  refresh:user:<user id>      set of the user's families, for revoke_user
+	Used tokens stay until their ttl runs out so a replay is still recognized.
+	"""
+	# KEYS[1] presented token, KEYS[2] next token, ARGV[1] ttl, ARGV[2] revocation version key prefix
+	# the family, user and version keys are built in the script, they are only known once the token is read.
+	# The user's revocation version is returned with the next token, the new access token needs no second round trip
+	ROTATE = """
+	local token = redis.call('HMGET', KEYS[1], 'user', 'family', 'used')
+	if not token[1] then
+		return {0}
+	end
+	local family = 'refresh:family:' .. token[2]
+	if token[3] == '1' then
+		redis.call('DEL', family)
+		return {-1, token[1]}
+	end
+	if redis.call('EXISTS', family) == 0 then
+		return {0}
+	end
+	redis.call('HSET', KEYS[1], 'used', 1)
+	redis.call('HSET', KEYS[2], 'user', token[1], 'family', token[2], 'used', 0)
+	redis.call('EXPIRE', KEYS[2], ARGV[1])
+	redis.call('EXPIRE', family, ARGV[1])
+	redis.call('EXPIRE', 'refresh:user:' .. token[1], ARGV[1])
+	return {1, token[1], redis.call('GET', ARGV[2] .. token[1]) or '0'}
+	"""
+
+	# KEYS[1] user set
+	REVOKE_USER = """
+	for _, family in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+		redis.call('DEL', 'refresh:family:' .. family)
+	end
+	return redis.call('DEL', KEYS[1])
+	"""
+
+	def __init__(self, client):
+		self.client = client
+		self._rotate = client.register_script(self.ROTATE)
+		self._revoke_user = client.register_script(self.REVOKE_USER)
+
+	def issue(self, user_id, ttl):
+		token, family = _new_token(), uuid.uuid4().hex
+		key = f'refresh:{_digest(token)}'
+		pipe = self.client.pipeline()
+		pipe.hset(key, mapping={'user': user_id, 'family': family, 'used': 0})
+		pipe.expire(key, ttl)
+		pipe.set(f'refresh:family:{family}', user_id, ex=ttl)
+		pipe.sadd(f'refresh:user:{user_id}', family)
+		pipe.expire(f'refresh:user:{user_id}', ttl)
+		pipe.execute()
+		return token
+
+	# (ROTATED, user id, next token, revocation version), (REUSED, user id, None, None) or (INVALID, None, None, None)
+	def rotate(self, token, ttl):
+		next_token = _new_token()
+		keys = [f'refresh:{_digest(token)}', f'refresh:{_digest(next_token)}']
+		result = self._rotate(keys=keys, args=[ttl, VERSION_PREFIX])
+		if result[0] == ROTATED:
+			return ROTATED, int(result[1]), next_token, int(result[2])
+		if result[0] == REUSED:
+			return REUSED, int(result[1]), None, None
+		return INVALID, None, None, None
+
+	# log out of one device, the family of the token is revoked
+	def revoke(self, token):
+		family = self.client.hget(f'refresh:{_digest(token)}', 'family')
+		if family:
+			self.client.delete(f'refresh:family:{family}')
+		return family is not None
+
+	# log out everywhere, after a password change
+	def revoke_user(self, user_id):
+		self._revoke_user(keys=[f'refresh:user:{user_id}'])
+
+
+class MemoryRefreshStore():
+	"""
+	In-process store for single process deployments and tests, same rules as the redis store.
+	Entries expire after their ttl, the oldest tokens are evicted beyond max_size.
+	"""
+	def __init__(self, max_size):
+		self.max_size = max_size
+		self._tokens = OrderedDict()	# digest -> [user id, family, used, expires]
+		self._families = {}				# family -> [user id, expires]
+		self._lock = threading.Lock()
+
+	def _live(self, table, key):
+		entry = table.get(key)
+		if entry is not None and entry[-1] <= time.monotonic():
+			del table[key]
+			return None
+		return entry
+
+	def _add_token(self, token, user_id, family, ttl):
+		self._tokens[_digest(token)] = [user_id, family, False, time.monotonic() + ttl]
+		while len(self._tokens) > self.max_size:
+			self._tokens.popitem(last=False)
+
+	def issue(self, user_id, ttl):
+		token, family = _new_token(), uuid.uuid4().hex
+		with self._lock:
+			self._families[family] = [user_id, time.monotonic() + ttl]
+			while len(self._families) > self.max_size:
+				self._families.pop(next(iter(self._families)))
+			self._add_token(token, user_id, family, ttl)
+		return token
+
+	# the revocation version is left to the caller (None), reading it in process costs no round trip
+	def rotate(self, token, ttl):
+		with self._lock:
+			entry = self._live(self._tokens, _digest(token))
+			if entry is None:
+				return INVALID, None, None, None
+			user_id, family, used = entry[0], entry[1], entry[2]
+			if used:
+				self._families.pop(family, None)
+				return REUSED, user_id, None, None
+			if self._live(self._families, family) is None:
+				return INVALID, None, None, None
+
+			entry[2] = True
+			next_token = _new_token()
+			self._add_token(next_token, user_id, family, ttl)
+			self._families[family][1] = time.monotonic() + ttl
+			return ROTATED, user_id, next_token, None
+
+	def revoke(self, token):
+		with self._lock:
+			entry = self._live(self._tokens, _digest(token))
+			if entry is None:
+				return False
+			self._families.pop(entry[1], None)
+			return True
+
+	def revoke_user(self, user_id):
+		with self._lock:
+			for family in [f for f, entry in self._families.items() if entry[0] == user_id]:
+				del self._families[family]
+
+
+# ===============================================
+def init_app(app):
+	if app.config['STATE_BACKEND'] == 'memory':
+		store = MemoryRefreshStore(app.config['MEMORY_STATE_MAX_KEYS'])
+	else:
+		store = RedisRefreshStore(redis_client)
+	app.extensions['refresh_tokens'] = store
+
+
+def _store():
+	return current_app.extensions['refresh_tokens']
+
+
+# start a new family for a log in, returns the refresh token
+def issue(user_id):
+	return _store().issue(user_id, current_app.config['REFRESH_TOKEN_TTL'])
+
+
+def rotate(token):
+	return _store().rotate(token, current_app.config['REFRESH_TOKEN_TTL'])
+
+
+def revoke(token):
+	return _store().revoke(token)
+
+
+def revoke_user(user_id):
+	return _store().revoke_user(user_id)
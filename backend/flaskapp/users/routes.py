@@ -1,10 +1,14 @@
-import jwt
-import datetime
 from flaskapp.db_models import User
-from flaskapp.users.messages import send_otp
-from flaskapp import redis_client, bcrypt, db
-from flask import Blueprint, jsonify, request, current_app
-from flaskapp.users.utils import generate_otp
+from flaskapp.users.outbox import enqueue_otp
+from flaskapp import hasher, db, revocation
+from flaskapp.database import use_primary
+from flaskapp.hashing import HashingBusy
+from flaskapp.users import otp_store, refresh_tokens
+from flaskapp.users.bloom import get_bloom
+from flaskapp.http_cache import cache_response
+from flaskapp.ratelimit import rate_limit, login_failures, register_failure, reset_failures, lock_response
+from flask import Blueprint, jsonify, request, current_app, g
+from flaskapp.users.utils import generate_otp, create_access_token
 from flaskapp.utils import (
 	login_required, logout_required,
 	validate_request_json,
@@ -23,38 +27,38 @@ users_bp = Blueprint("users", __name__)
 # create user
 @users_bp.route("/sign-up/", methods=["POST"])
 @logout_required
+@rate_limit(20, 3600, key='ip')
 @validate_request_json({
 	'name': {'required': True, 'min_len': MIN_NAME_LENGTH, 'max_len': MAX_NAME_LENGTH},
 	'email': {'required': True, 'min_len': MIN_EMAIL_LENGTH, 'max_len': MAX_EMAIL_LENGTH, 'regex': EMAIL_REGEX}
 })
+@rate_limit(5, 3600, key='email')
 def sign_up(name_stripped, email_stripped):
 	# Check if username and email already exist
 	errors = {}
-	if User.check_name(name_stripped):
+	taken = User.check_taken(name_stripped, email_stripped)
+	if taken['name']:
 		errors['nameStatus'] = 'Username already taken.'
 
-	if User.check_email(email_stripped):
+	if taken['email']:
 		errors['emailStatus'] = 'Email already taken.'
 
 	# 409 Conflict for duplicate entries
 	if errors:
 		return jsonify(errors), 409
 
-	# Generate OTP and send it
+	# reserve the otp first so concurrent requests can't both send an email
 	otp = generate_otp()
-	is_sent = send_otp(otp, email_stripped)
-
-	# email sent fail
-	if not is_sent:
-		return jsonify({"error": "Failed to send OTP."}), 500
-
-	# if otp, try after 2 minutes
-	stored_otp = redis_client.get(email_stripped)
-	if stored_otp:
+	if not otp_store.issue(email_stripped, otp):
 		return jsonify({"error": "Please try again after 2 minutes."}), 400
 
-	# if email sent than store the otp with email for 2 minutes
-	redis_client.setex(email_stripped, 120, otp)
+	# queue the email, the outbox worker delivers it
+	message_id = enqueue_otp(otp, email_stripped)
+
+	# email could not be queued, free the reservation
+	if not message_id:
+		otp_store.release(email_stripped, otp)
+		return jsonify({"error": "Failed to send OTP."}), 500
 	
 	return jsonify({"message": "OTP sent to email."}), 200
 
@@ -63,87 +67,192 @@ def sign_up(name_stripped, email_stripped):
 # verify signup otp and store the user in the database
 @users_bp.route('/verify/', methods=['POST'])
 @logout_required
+@rate_limit(30, 600, key='ip')
 @validate_request_json({
 	'otp': {'required': True, 'min_len': OTP_LENGTH, 'max_len': OTP_LENGTH},
 	'name': {'required': True, 'min_len': MIN_NAME_LENGTH, 'max_len': MAX_NAME_LENGTH},
 	'email': {'required': True, 'min_len': MIN_EMAIL_LENGTH, 'max_len': MAX_EMAIL_LENGTH, 'regex': EMAIL_REGEX},
 	'password': {'required': True, 'min_len': MIN_PASS_LENGTH, 'max_len': MAX_PASS_LENGTH, 'regex': PASSWORD_REGEX}
 })
+@rate_limit(10, 600, key='email')
 def verify(otp_stripped, name_stripped, email_stripped, password_stripped):
-	# check stored otp for given email in redis cache
-	stored_otp = redis_client.get(email_stripped)
-
-	# check otp in redis client and if there is a otp, match with given otp
-	if not stored_otp or stored_otp != otp_stripped:
+	# match the given otp with the one stored for this email
+	if not otp_store.verify(email_stripped, otp_stripped):
 		return jsonify({"error": "Timeout or invalid OTP."}), 400
 
-	if User.check_name(name_stripped):
+	# checked on the primary, a lagging replica could miss a user created a moment ago
+	with use_primary():
+		taken = User.check_taken(name_stripped, email_stripped)
+	if taken['name']:
 		return jsonify({"error": "Username already taken."}), 400
 
-	if User.check_email(email_stripped):
+	if taken['email']:
 		return jsonify({"error": "Email already taken."}), 400
 
 	# store in database
-	hashed_pass = bcrypt.generate_password_hash(password_stripped, rounds=13).decode('utf-8')
-	name_stripped = name_stripped.replace(' ', '-').lower()
+	hashed_pass = hasher.generate_password_hash(password_stripped)
+
+	# consume the otp, only one of several concurrent requests gets past this
+	if not otp_store.consume(email_stripped, otp_stripped):
+		return jsonify({"error": "Timeout or invalid OTP."}), 400
+
+	name_stripped = User.normalize_name(name_stripped)
 	user = User(username=name_stripped, email=email_stripped, password=hashed_pass)
 	db.session.add(user)
 	db.session.commit()
-	redis_client.delete(email_stripped)
+	get_bloom().add_user(user.username, user.email_normalized)
 
 	return jsonify({"message": "Signup successful."}), 200
 
 
+# =================================================================
+# live username / email availability while the sign up form is typed
+# ?name=...&email=... , either one or both, true means available
+@users_bp.route('/availability/')
+@logout_required
+@rate_limit(120, 60, key='ip')
+def availability():
+	checks = {}
+	name = request.args.get('name', '').strip()
+	email = request.args.get('email', '').strip()
+
+	if name:
+		if not MIN_NAME_LENGTH <= len(name) <= MAX_NAME_LENGTH:
+			return jsonify({"error": f"Name must be {MIN_NAME_LENGTH} to {MAX_NAME_LENGTH} characters."}), 400
+		checks['name'] = f'name:{User.normalize_name(name)}'
+
+	if email:
+		if len(email) > MAX_EMAIL_LENGTH or not EMAIL_REGEX.fullmatch(email):
+			return jsonify({"error": "Invalid email format."}), 400
+		checks['email'] = f'email:{User.normalize_email(email)}'
+
+	if not checks:
+		return jsonify({"error": "Name or email is required."}), 400
+
+	# definite negatives from the bloom filter need no database query,
+	# possible positives are confirmed with one indexed exists query
+	maybe_taken = dict(zip(checks, get_bloom().might_contain(list(checks.values()))))
+	taken = User.check_taken(name, email) if any(maybe_taken.values()) else {}
+	data = {field: not (maybe_taken[field] and taken[field]) for field in checks}
+
+	return jsonify(data), 200
+
+
 # =================================================================
 # login
 @users_bp.route('/log-in/', methods=['POST'])
 @logout_required
+@rate_limit(30, 300, key='ip')
 @validate_request_json({
 	'email': {'required': True, 'min_len': MIN_EMAIL_LENGTH, 'max_len': MAX_EMAIL_LENGTH, 'regex': EMAIL_REGEX},
 	'password': {'required': True, 'min_len': MIN_PASS_LENGTH, 'max_len': MAX_PASS_LENGTH, 'regex': PASSWORD_REGEX}
 })
+@rate_limit(10, 60, key='email')
 def log_in(email_stripped, password_stripped):
+	# locked accounts are rejected before any database or bcrypt work
+	failures = login_failures(email_stripped)
+	if failures >= current_app.config['LOGIN_MAX_FAILURES']:
+		return lock_response()
+
 	# load user
-	user = User.query.filter_by(email=email_stripped).first()
-	if not user or not bcrypt.check_password_hash(user.password, password_stripped):
+	user = User.get_by_email(email_stripped)
+	if not user or not hasher.check_password_hash(user.password, password_stripped):
+		register_failure(email_stripped)
 		return jsonify({"error": "Invalid credentials!"}), 400
+
+	if failures:
+		reset_failures(email_stripped)
+
+	# rehash when the stored cost differs from the current one, while we have the plain password
+	# a full hashing pool must not fail a verified log in, the next log in upgrades the hash
+	if hasher.needs_rehash(user.password):
+		try:
+			user.password = hasher.generate_password_hash(password_stripped)
+			db.session.commit()
+		except HashingBusy:
+			pass
 	
-	# create jwt token
-	token = jwt.encode(
-		{'id' : user.id, 'exp' : datetime.datetime.utcnow() + datetime.timedelta(minutes=current_app.config['JWT_TIMEOUT'])},
-		current_app.config['SECRET_KEY'], algorithm="HS256")
+	# short lived access token, renewed with the refresh token without the password
+	data = {
+		"username": user.username,
+		"token": create_access_token(user.id),
+		"refresh_token": refresh_tokens.issue(user.id)
+	}
+
+	return jsonify(data), 200
 
-	data = { "username": user.username, "token": token }
+
+# =================================================================
+# new access token for a refresh token, no bcrypt and no database query
+# the refresh token is single use, the answer carries the next one
+@users_bp.route('/refresh/', methods=['POST'])
+@rate_limit(60, 60, key='ip')
+@validate_request_json({
+	'refresh_token': {'required': True, 'min_len': 20, 'max_len': 100}
+})
+def refresh(refresh_token_stripped):
+	status, user_id, next_token, version = refresh_tokens.rotate(refresh_token_stripped)
+	if status == refresh_tokens.REUSED:
+		current_app.logger.warning(f'refresh token reused for user {user_id}, family revoked')
+		return jsonify({"error": "Refresh token already used, please log in again."}), 401
+	if status != refresh_tokens.ROTATED:
+		return jsonify({"error": "Invalid refresh token!"}), 401
+
+	data = {
+		"token": create_access_token(user_id, version),
+		"refresh_token": next_token
+	}
 
 	return jsonify(data), 200
 	
 
+# =================================================================
+# logout, revokes the access token and the refresh token sent in the body
+# {"all": true} ends every session of the user
+@users_bp.route('/log-out/', methods=['POST'])
+@login_required
+def log_out(current_user):
+	data = request.get_json(silent=True)
+	data = data if isinstance(data, dict) else {}
+	user_id = g.token_claims['id']
+
+	if data.get('all') is True:
+		revocation.revoke_user(user_id)
+		refresh_tokens.revoke_user(user_id)
+		return jsonify({"message": "Logged out everywhere."}), 200
+
+	revocation.revoke_token(g.token_claims)
+	if isinstance(data.get('refresh_token'), str):
+		refresh_tokens.revoke(data['refresh_token'])
+
+	return jsonify({"message": "Logged out."}), 200
+
+
 # =================================================================
 # reset password
 @users_bp.route("/reset-password/", methods=["POST"])
 @logout_required
+@rate_limit(20, 3600, key='ip')
 @validate_request_json({
 	'email': {'required': True, 'min_len': MIN_EMAIL_LENGTH, 'max_len': MAX_EMAIL_LENGTH, 'regex': EMAIL_REGEX}
 })
+@rate_limit(5, 3600, key='email')
 def reset_password(email_stripped):
 	# load user
-	user = User.query.filter_by(email=email_stripped).first()
+	user = User.get_by_email(email_stripped)
 	if not user:
 		return jsonify({"error": "Please check your email address."}), 400
 		
-	# if otp already in cache than need to wait 2 minutes
-	stored_otp = redis_client.get(email_stripped)
-	if stored_otp:
+	# reserve the otp, if one is already stored than need to wait 2 minutes
+	otp = generate_otp()
+	if not otp_store.issue(email_stripped, otp):
 		return jsonify({"error": "Please try again after 2 minutes."}), 400
 
-	# Generate OTP and send it
-	otp = generate_otp()
-	is_sent = send_otp(otp, email_stripped)
-	if not is_sent:
+	# queue the email, the outbox worker delivers it
+	message_id = enqueue_otp(otp, email_stripped)
+	if not message_id:
+		otp_store.release(email_stripped, otp)
 		return jsonify({"error": "Failed to send OTP."}), 500
-	
-	# if email sent than store the otp with email for 2 minutes
-	redis_client.setex(email_stripped, 120, otp)
 
 	return jsonify({"message": "OTP sent to email."}), 200
 
@@ -152,14 +261,15 @@ def reset_password(email_stripped):
 # verify reset otp
 @users_bp.route("/verify-reset-otp/", methods=["POST"])
 @logout_required
+@rate_limit(30, 600, key='ip')
 @validate_request_json({
 	'email': {'required': True, 'min_len': MIN_EMAIL_LENGTH, 'max_len': MAX_EMAIL_LENGTH, 'regex': EMAIL_REGEX},
 	'otp': {'required': True, 'min_len': OTP_LENGTH, 'max_len': OTP_LENGTH}
 })
+@rate_limit(10, 600, key='email')
 def verify_reset_otp(email_stripped, otp_stripped):
-	# check stored otp for given email in redis cache
-	stored_otp = redis_client.get(email_stripped)
-	if not stored_otp or stored_otp != otp_stripped:
+	# match the given otp with the one stored for this email, it stays valid for new-password
+	if not otp_store.verify(email_stripped, otp_stripped):
 		return jsonify({"error": "Timeout or invalid OTP."}), 400
 	
 	return jsonify({"message": "Otp matched."}), 200
@@ -169,23 +279,33 @@ def verify_reset_otp(email_stripped, otp_stripped):
 # set new password
 @users_bp.route("/new-password/", methods=["POST"])
 @logout_required
+@rate_limit(30, 600, key='ip')
 @validate_request_json({
 	'email': {'required': True, 'min_len': MIN_EMAIL_LENGTH, 'max_len': MAX_EMAIL_LENGTH, 'regex': EMAIL_REGEX},
 	'password': {'required': True, 'min_len': MIN_PASS_LENGTH, 'max_len': MAX_PASS_LENGTH, 'regex': PASSWORD_REGEX},
 	'otp': {'required': True, 'min_len': OTP_LENGTH, 'max_len': OTP_LENGTH},
 })
+@rate_limit(10, 600, key='email')
 def new_pass(email_stripped, otp_stripped, password_stripped):
-	# check stored otp for given email in redis cache
-	stored_otp = redis_client.get(email_stripped)
-	if not stored_otp or stored_otp != otp_stripped:
+	# match the given otp with the one stored for this email
+	if not otp_store.verify(email_stripped, otp_stripped):
+		return jsonify({"error": "Timeout or invalid OTP."}), 400
+
+	hashed_pass = hasher.generate_password_hash(password_stripped)
+
+	# consume the otp so it can't be replayed
+	if not otp_store.consume(email_stripped, otp_stripped):
 		return jsonify({"error": "Timeout or invalid OTP."}), 400
 
 	# store new password in database
-	user = User.query.filter_by(email=email_stripped).first()
-	hashed_pass = bcrypt.generate_password_hash(password_stripped, rounds=13).decode('utf-8')
+	with use_primary():
+		user = User.get_by_email(email_stripped)
 	user.password = hashed_pass
 	db.session.commit()
-	redis_client.delete(email_stripped)
+
+	# every session started with the old password ends, access and refresh tokens
+	revocation.revoke_user(user.id)
+	refresh_tokens.revoke_user(user.id)
 
 	return jsonify({"message": "Password changed."}), 200
 
@@ -194,6 +314,7 @@ def new_pass(email_stripped, otp_stripped, password_stripped):
 # account endpoint
 @users_bp.route('/account/')
 @login_required
+@cache_response(private=True, server_ttl=60)
 def account(current_user):
 	data = {
 		"name": current_user.username,
@@ -1,10 +1,24 @@
 import json
 import hmac
 import random
+import secrets
 import hashlib
+import datetime
 from flask import current_app
+from flaskapp import keyring, revocation
 
 # generate a random 6 digit code
 def generate_otp():
 	otp = random.randint(0,999999)
-	return f"{otp:06}"
\ No newline at end of file
+	return f"{otp:06}"
+
+
+# short lived access token signed by the keyring, sent as "<AUTH_PREFIX> <token>" and checked by login_required
+# jti and ver let flaskapp/revocation.py revoke it before it expires, a ver already read by the caller is used as is
+def create_access_token(user_id, version=None):
+	return keyring.encode({
+		'id' : user_id,
+		'exp' : datetime.datetime.utcnow() + datetime.timedelta(minutes=current_app.config['JWT_TIMEOUT']),
+		'jti' : secrets.token_urlsafe(12),
+		'ver' : revocation.version(user_id) if version is None else version
+	})
\ No newline at end of file
@@ -1,8 +1,8 @@
 import re
 import jwt
 from functools import wraps
-from flaskapp.db_models import User
-from flask import request, current_app, jsonify
+from flaskapp import user_cache, keyring, revocation
+from flask import request, current_app, jsonify, g
 
 
 # ===============================================
@@ -25,13 +25,20 @@ def login_required(f):
 
 		# loading data from jwt can throw exceptions
 		try:
-			data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-			current_user = User.query.filter_by(id=data.get('id')).first()
+			data = keyring.decode(token)
 		except jwt.ExpiredSignatureError:
 			return jsonify({"error": "Token has expired!"}), 401
 		except jwt.InvalidTokenError:
 			return jsonify({"error": "Invalid token!"}), 401
 
+		# logged out or issued before the last password change
+		if revocation.is_revoked(data):
+			return jsonify({"error": "Token has been revoked!"}), 401
+
+		# the claims stay available to the route, log out revokes this token by its jti
+		g.token_claims = data
+		current_user = user_cache.get(data.get('id'))
+
 		# return user with args and kwargs to access in route
 		return f(current_user, *args, **kwargs)
 	return inner
@@ -61,71 +68,107 @@ MAX_PASS_LENGTH = 20
 PASSWORD_REGEX = re.compile(r"^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)[a-zA-Z\d]{8,20}$")
 
 
+# ===============================================
 # validator decorator
-def validate_request_json(fields_to_validate):
+# the rules are compiled once per route into one check function per field,
+# a request only runs the checks, every message is already formatted
+
+def _compile_field(field_name, rules):
+	required = rules.get('required', False)
+	min_len = rules.get('min_len')
+	max_len = rules.get('max_len')
+	regex = rules.get('regex')
+	coerce = rules.get('type')
+	if isinstance(regex, str):
+		regex = re.compile(regex)
+	fullmatch = regex.fullmatch if regex else None
+
+	label = field_name.capitalize()
+	empty_error = f'{label} cannot be empty.'
+	min_error = f'{label} must be at least {min_len} characters.'
+	max_error = f'{label} must be at most {max_len} characters.'
+	format_error = f'Invalid {field_name} format.'
+	type_error = f'{label} must be a valid {getattr(coerce, "__name__", "value")}.'
+
+	# returns (error, stripped value)
+	def check(value):
+		if value is None:
+			return (empty_error, None) if required else (None, None)
+
+		stripped = (value if type(value) is str else str(value)).strip()
+		if not stripped:
+			return (empty_error, None) if required else (None, stripped)
+		if min_len is not None and len(stripped) < min_len:
+			return min_error, None
+		if max_len is not None and len(stripped) > max_len:
+			return max_error, None
+		if fullmatch is not None and not fullmatch(stripped):
+			return format_error, None
+		if coerce is not None:
+			try:
+				stripped = coerce(stripped)
+			except (TypeError, ValueError):
+				return type_error, None
+		return None, stripped
+	return check
+
+
+def _too_large():
+	return jsonify({'error': 'Request body too large.'}), 413
+
+
+def validate_request_json(fields_to_validate, collect_all=False, max_bytes=None):
 	"""
 	Decorator to validate incoming JSON request data against specified rules.
 	Passed validated and stripped fields as keyword arguments to the decorated function.
 
 	Args:
 		{ 'email': {'required': True, 'min_len': MIN_EMAIL_LENGTH, 'max_len': MAX_EMAIL_LENGTH, 'regex': EMAIL_REGEX} }
-		{ 'required': bool, 'min_len': int, 'max_len': int, 'regex': re.Pattern }
+		{ 'required': bool, 'min_len': int, 'max_len': int, 'regex': re.Pattern | str, 'type': callable }
+		collect_all: answer with every field error in 'errors', not only the first one in 'error'
+		max_bytes: body size limit, MAX_JSON_BYTES from the config by default
 	"""
+	checks = [(field_name, f'{field_name}_stripped', _compile_field(field_name, rules)) for field_name, rules in fields_to_validate.items()]
+
 	def decorator(f):
 		@wraps(f)
 		def inner(*args, **kwargs):
-			response_data = request.get_json()
+			# refuse oversized bodies before parsing them
+			req = request._get_current_object()
+			limit = max_bytes or current_app.config['MAX_JSON_BYTES']
+			length = req.content_length
+			if length is None:
+				# chunked body, read at most one byte past the limit to tell whether it is over
+				req.max_content_length = limit + 1
+				if len(req.get_data()) > limit:
+					return _too_large()
+			elif length > limit:
+				return _too_large()
+
+			response_data = req.get_json()
 
 			# check for empty JSON body
-			if not response_data:
+			if not response_data or not isinstance(response_data, dict):
 				return jsonify({'error': 'Request must be JSON.'}), 400
 
 			validated_stripped_data = {}
-			validation_errors = []
-
-			# loop over all given items
-			for field_name, rules in fields_to_validate.items():
-				value = response_data.get(field_name)
-				is_required = rules.get('required', False)
-				min_len = rules.get('min_len')
-				max_len = rules.get('max_len')
-				regex = rules.get('regex')
-
-				stripped_value = None
-				if value is not None:
-					stripped_value = str(value).strip()
-
-				# 1. Check if required and empty
-				if is_required and (stripped_value is None or stripped_value == ''):
-					validation_errors.append(f'{field_name.capitalize()} cannot be empty.')
-					# Skip further validation for this field if it's empty and required
-					continue 
-
-				# Only proceed with length/regex if a non-empty value is provided
-				if stripped_value is not None and stripped_value != '':
-					# Minimum length validation
-					if min_len is not None and len(stripped_value) < min_len:
-						validation_errors.append(f'{field_name.capitalize()} must be at least {min_len} characters.')
-						continue
-					
-					# Maximum length validation
-					if max_len is not None and len(stripped_value) > max_len:
-						validation_errors.append(f'{field_name.capitalize()} must be at most {max_len} characters.')
-						continue
-
-					# Regex validation (email, password)
-					if regex and not regex.fullmatch(stripped_value):
-						validation_errors.append(f'Invalid {field_name} format.')
-						continue
-
-				# Store the processed/stripped value
-				validated_stripped_data[f'{field_name}_stripped'] = stripped_value
+			validation_errors = {}
+			for field_name, key, check in checks:
+				error, value = check(response_data.get(field_name))
+				if error is None:
+					validated_stripped_data[key] = value
+					continue
+				if not collect_all:
+					return jsonify({'error': error}), 400
+				validation_errors[field_name] = error
 
 			if validation_errors:
-				# Return the first encountered error message, as per original style
-				return jsonify({'error': validation_errors[0]}), 400
+				return jsonify({'error': next(iter(validation_errors.values())), 'errors': validation_errors}), 400
 
 			# Pass validated and stripped data as keyword arguments to the route function
 			return f(*args, **kwargs, **validated_stripped_data)
+
+		# the rules stay readable on the view, the outer decorators copy them with functools.wraps
+		inner.json_rules = fields_to_validate
 		return inner
-	return decorator
\ No newline at end of file
+	return decorator
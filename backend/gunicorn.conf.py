@@ -0,0 +1,74 @@
+import os
+from flaskapp.config import Config
+
+# production server
+#   cd backend && gunicorn -c gunicorn.conf.py wsgi:app
+# the app is imported once in the master and the workers are forked from it,
+# each worker drops the connections it inherited and warms up before it accepts requests
+
+
+def cpu_count():
+	# cpus this process may run on, smaller than os.cpu_count() in a container with a cpu set
+	try:
+		return len(os.sched_getaffinity(0))
+	except AttributeError:
+		return os.cpu_count() or 1
+
+
+# workers and threads per worker for the load type
+#   io   requests mostly wait on the database, redis and the bcrypt pool, threads overlap the waits
+#   cpu  requests mostly compute in python, one single threaded worker per core
+# every worker also starts HASH_WORKERS bcrypt processes
+def autotune(cpus, load_type):
+	if load_type == 'cpu':
+		return cpus + 1, 1
+	return 2 * cpus + 1, 4
+
+
+_workers, _threads = autotune(cpu_count(), Config.WEB_LOAD_TYPE)
+
+# metrics of all workers are added up from files in this directory, it must be set before the app is created
+# (wsgi.py), metrics.init_app imports prometheus_client then
+if Config.METRICS_ENABLED and Config.METRICS_MULTIPROC_DIR:
+	os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', Config.METRICS_MULTIPROC_DIR)
+
+bind = Config.WEB_BIND
+workers = Config.WEB_WORKERS or _workers
+threads = Config.WEB_THREADS or _threads
+worker_class = 'gthread' if threads > 1 else 'sync'
+preload_app = True
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+# recycle workers now and then so a slow leak can't grow forever, the jitter keeps them from restarting together
+max_requests = 5000
+max_requests_jitter = 500
+
+
+# samples left by a previous run would be added to the new ones
+def on_starting(server):
+	path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+	if path:
+		os.makedirs(path, exist_ok=True)
+		for name in os.listdir(path):
+			if name.endswith('.db'):
+				os.remove(os.path.join(path, name))
+
+
+def child_exit(server, worker):
+	if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+		from prometheus_client import multiprocess
+		multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+	from wsgi import app
+	from flaskapp.lifecycle import after_fork
+	after_fork(app)
+
+
+def post_worker_init(worker):
+	from wsgi import app
+	from flaskapp.lifecycle import warm_up
+	elapsed = warm_up(app, connections=threads)
+	worker.log.info(f'worker {worker.pid} warmed up in {elapsed * 1000:.0f} ms')
@@ -2,8 +2,8 @@ from flaskapp import create_app, db
 
 app = create_app()
 
-with app.app_context():
-	db.create_all()
-	
+# development server, production runs wsgi.py under gunicorn
 if __name__ == '__main__':
-	app.run(debug=True)
\ No newline at end of file
+	with app.app_context():
+		db.create_all()
+	app.run(debug=True)
@@ -0,0 +1,36 @@
+import os
+import sys
+import socket
+import argparse
+
+# the worker keeps its metrics to itself and serves them on its own port,
+# it must not write into the directory the gunicorn workers share and empty at startup
+os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+
+from flaskapp import create_app, metrics
+from flaskapp.users import outbox
+
+app = create_app()
+
+# outbox email worker
+#   python worker.py [--name mail-1]	drain the outbox
+#   python worker.py status <id>		show the delivery status of a message
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Outbox email worker.')
+	parser.add_argument('command', nargs='?', default='run', choices=['run', 'status'])
+	parser.add_argument('message_id', nargs='?')
+	parser.add_argument('--name', default=socket.gethostname(),
+		help='stable worker name, unfinished jobs of a worker with the same name are recovered on start')
+	parser.add_argument('--metrics-port', type=int, default=app.config['METRICS_WORKER_PORT'],
+		help='prometheus metrics on 127.0.0.1:<port> when METRICS_ENABLED, one port per worker, 0 = off')
+	args = parser.parse_args()
+
+	with app.app_context():
+		if args.command == 'status':
+			status = outbox.get_status(args.message_id)
+			print(status if status else 'unknown message')
+			sys.exit(0 if status else 1)
+
+		if metrics.start_http_server(args.metrics_port):
+			app.logger.info(f'outbox worker metrics on http://127.0.0.1:{args.metrics_port}/metrics')
+		outbox.run_worker(args.name)
@@ -0,0 +1,6 @@
+from flaskapp import create_app
+
+# WSGI entry point for gunicorn, settings and fork hooks in gunicorn.conf.py
+#   cd backend && gunicorn -c gunicorn.conf.py wsgi:app
+# create the tables once before the first start with: flask --app wsgi init-db
+app = create_app()
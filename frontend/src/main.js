@@ -10,6 +10,20 @@ import Notifications from '@kyvg/vue3-notification'
 // server address
 axios.defaults.baseURL = store.authState.SERVER_ADDR
 
+// an expired access token is renewed once with the refresh token and the request repeated
+axios.interceptors.response.use(null, async (error) => {
+	const request = error.config
+	if (error.response && error.response.status === 401 && request && request.headers.Authorization
+		&& !request._retried && store.authState.refreshToken) {
+		request._retried = true
+		if (await store.authActions.refresh()) {
+			request.headers.Authorization = store.authActions.getAuthorizationHeader().Authorization
+			return axios(request)
+		}
+	}
+	return Promise.reject(error)
+})
+
 const app = createApp(App)
 
 // make accessable reactive store object to the entire app
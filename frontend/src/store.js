@@ -1,3 +1,4 @@
+import axios from "axios"
 import { reactive, readonly } from "vue"
 
 // configuration file
@@ -8,25 +9,58 @@ import config from "../../frontend_config.json"
 
 const authState = reactive({
 	token: localStorage.getItem('token'),
+	refreshToken: localStorage.getItem('refreshToken'),
 	SERVER_ADDR: config.SERVER_ADDR,
 	FRONTEND: config.FRONTEND,
 	username: localStorage.getItem('username')
 })
 
+let refreshing = null
+
 // --- Auth Actions Object ---
 const authActions = {
-    updateToken(token) {
+    updateToken(token, refreshToken) {
         authState.token = token
         localStorage.setItem('token', token)
+        if (refreshToken) {
+            authState.refreshToken = refreshToken
+            localStorage.setItem('refreshToken', refreshToken)
+        }
+    },
+
+    // new access token for the refresh token, resolves to false when the user has to log in again
+    // requests failing together share one call, a refresh token is only valid once
+    refresh() {
+        if (!refreshing) {
+            refreshing = axios.post('/users/refresh/', { refresh_token: authState.refreshToken })
+                .then(({ data }) => {
+                    authActions.updateToken(data.token, data.refresh_token)
+                    return true
+                })
+                .catch(() => false)
+                .finally(() => { refreshing = null })
+        }
+        return refreshing
     },
 
     getAuthorizationHeader() {
         return { 'Authorization': `${config.AUTH_PREFIX} ${authState.token}` }
     },
 
+    // revoke the tokens on the server, the local state is cleared whatever the answer
+    logOut() {
+        const request = axios.post('/users/log-out/', { refresh_token: authState.refreshToken }, {
+            headers: authActions.getAuthorizationHeader()
+        }).catch(() => {})
+        authActions.resetAuth()
+        return request
+    },
+
     resetAuth() {
         authState.token = null
+        authState.refreshToken = null
         localStorage.removeItem('token')
+        localStorage.removeItem('refreshToken')
     }, 
 
     setUsername(name) {
@@ -12,6 +12,7 @@ user_1 = {
     "test_email": "webwaymark@gmail.com",
     "test_pass": "Asdf1111",
     "token": "",
+    "refresh_token": "",
 }
 
 user_2 = {
@@ -44,6 +45,13 @@ def test_sign_up(api_client):
     assert response.status_code == 400, "Expected status code 400"
     assert response.json().get("error") == "Request must be JSON."
 
+    # =========================================
+    # oversized payload
+    payload = { "name": "a" * 20000, "email": user_1["test_email"] }
+    response = api_client.post(f"{api_client.base_url}/users/sign-up/", json=payload)
+    assert response.status_code == 413, "Expected status code 413"
+    assert response.json().get("error") == "Request body too large."
+
     # =========================================
     # empty name
     payload = { "email": user_1["test_email"] }
@@ -447,6 +455,7 @@ def test_log_in(api_client):
     response = api_client.post(f"{api_client.base_url}/users/log-in/", json=payload)
     token = response.json().get('token')
     user_1["token"] = token
+    user_1["refresh_token"] = response.json().get('refresh_token')
 
     # ================================
     # login credentials user 2
@@ -461,6 +470,49 @@ def test_log_in(api_client):
     print("=================== Login test passed ==================")
 
 
+# refresh endpoint
+def test_refresh(api_client):
+    # =========================================
+    # empty payload
+    response = api_client.post(f"{api_client.base_url}/users/refresh/", json={})
+    assert response.status_code == 400, "Expected status code 400"
+    assert response.json().get("error") == "Request must be JSON."
+
+    # =========================================
+    # unknown refresh token
+    payload = {
+        "refresh_token": "thisisnotarefreshtokenfortesting",
+    }
+    response = api_client.post(f"{api_client.base_url}/users/refresh/", json=payload)
+    assert response.status_code == 401, "Expected status code 401"
+    assert response.json().get("error") == "Invalid refresh token!"
+
+    # =========================================
+    # success request, the token is rotated
+    payload = {
+        "refresh_token": user_1["refresh_token"],
+    }
+    response = api_client.post(f"{api_client.base_url}/users/refresh/", json=payload)
+    assert response.status_code == 200, "Expected status code 200"
+    assert response.json().get("token")
+    assert response.json().get("refresh_token") != user_1["refresh_token"]
+    next_refresh_token = response.json().get("refresh_token")
+
+    # =========================================
+    # the used token again revokes the whole family
+    response = api_client.post(f"{api_client.base_url}/users/refresh/", json=payload)
+    assert response.status_code == 401, "Expected status code 401"
+    assert response.json().get("error") == "Refresh token already used, please log in again."
+
+    payload = {
+        "refresh_token": next_refresh_token,
+    }
+    response = api_client.post(f"{api_client.base_url}/users/refresh/", json=payload)
+    assert response.status_code == 401, "Expected status code 401"
+
+    print("=================== Refresh test passed ==================")
+
+
 # test reset password route
 def test_reset_password(api_client):
     # ================================
@@ -763,5 +815,139 @@ def test_account(api_client):
     # update user_1 name
     user_1['name'] = response.json().get("name")
 
+    # =========================================
+    # revalidation with the etag of the previous response
+    assert "private" in response.headers.get("Cache-Control")
+    headers["If-None-Match"] = response.headers.get("ETag")
+    response = api_client.get(f"{api_client.base_url}/users/account/", headers=headers)
+    assert response.status_code == 304, "Expected status code 304"
+
+
+    print("=================== Account test passed ==================")
+
+# availability endpoint
+def test_availability(api_client):
+    # =========================================
+    # already loggedin user can't access availability
+    headers = {
+        "Authorization": f"{AUTH_PREFIX} thisisavalidtokenfortesting"
+    }
+    response = api_client.get(f"{api_client.base_url}/users/availability/", headers=headers)
+    assert response.status_code == 403, "Expected status code 403"
+
+    # =========================================
+    # without name and email
+    response = api_client.get(f"{api_client.base_url}/users/availability/")
+    assert response.status_code == 400, "Expected status code 400"
+    assert response.json().get("error") == "Name or email is required."
+
+    # =========================================
+    # invalid email format
+    response = api_client.get(f"{api_client.base_url}/users/availability/", params={"email": "asdfdd"})
+    assert response.status_code == 400, "Expected status code 400"
+    assert response.json().get("error") == "Invalid email format."
+
+    # =========================================
+    # existing user, email in different case
+    params = {"name": user_1["name"], "email": user_1["test_email"].upper()}
+    response = api_client.get(f"{api_client.base_url}/users/availability/", params=params)
+    assert response.status_code == 200, "Expected status code 200"
+    assert response.json() == {"name": False, "email": False}
+
+    # =========================================
+    # unused name and email
+    params = {"name": f"free name {int(time.time()) % 100000}", "email": f"free{int(time.time())}@example.com"}
+    response = api_client.get(f"{api_client.base_url}/users/availability/", params=params)
+    assert response.status_code == 200, "Expected status code 200"
+    assert response.json() == {"name": True, "email": True}
+
+    print("=================== Availability test passed ==================")
+
+
+# logout endpoint
+def test_log_out(api_client):
+    # =========================================
+    # without authorization header
+    response = api_client.post(f"{api_client.base_url}/users/log-out/")
+    assert response.status_code == 401, "Expected status code 401"
+
+    # =========================================
+    # success request with a new session, the token is revoked afterwards
+    payload = {
+        "email": user_1["test_email"],
+        "password": user_1["test_pass"],
+    }
+    response = api_client.post(f"{api_client.base_url}/users/log-in/", json=payload)
+    assert response.status_code == 200, "Expected status code 200"
+
+    headers = {
+        "Authorization": f"{AUTH_PREFIX} {response.json().get('token')}"
+    }
+    response = api_client.post(f"{api_client.base_url}/users/log-out/", headers=headers, json={})
+    assert response.status_code == 200, "Expected status code 200"
+    assert response.json().get("message") == "Logged out."
+
+    response = api_client.get(f"{api_client.base_url}/users/account/", headers=headers)
+    assert response.status_code == 401, "Expected status code 401"
+    assert response.json().get("error") == "Token has been revoked!"
+
+    print("=================== Logout test passed ==================")
+
+
+# failed log ins lock the email for this client
+def test_log_in_lock(api_client):
+    # a fresh email every run, the lock lasts LOGIN_LOCK_SECONDS
+    payload = {
+        "email": f"lock{int(time.time())}@example.com",
+        "password": user_1["test_pass"],
+    }
+
+    # =========================================
+    # wrong credentials until the lock, at most the per email rate limit
+    for _ in range(10):
+        response = api_client.post(f"{api_client.base_url}/users/log-in/", json=payload)
+        if response.status_code == 429:
+            break
+        assert response.status_code == 400, "Expected status code 400"
+        assert response.json().get("error") == "Invalid credentials!"
+
+    assert response.status_code == 429, "Expected status code 429"
+    assert response.json().get("error") == "Too many failed attempts, account locked. Please try again later."
+    assert response.headers.get("Retry-After"), "Expected a Retry-After header"
+
+    print("=================== Login lock test passed ==================")
+
+
+# wrong otps use up the otp, then the per email rate limit answers
+def test_otp_attempts(api_client):
+    otp = input('Enter the unused reset otp of user_1 to test the otp attempt cap. else enter to pass: ')
+    wrong = str((int(otp) + 1) % 1000000).zfill(6) if otp else "000000"
+
+    # =========================================
+    # OTP_MAX_ATTEMPTS (5) wrong otps
+    payload = {"email": user_1["test_email"], "otp": wrong}
+    for _ in range(5):
+        response = api_client.post(f"{api_client.base_url}/users/verify-reset-otp/", json=payload)
+        assert response.status_code == 400, "Expected status code 400"
+        assert response.json().get("error") == "Timeout or invalid OTP."
+
+    # the right otp is refused too once the attempts are used up
+    if otp:
+        payload = {"email": user_1["test_email"], "otp": otp}
+        response = api_client.post(f"{api_client.base_url}/users/verify-reset-otp/", json=payload)
+        assert response.status_code == 400, "Expected status code 400"
+        assert response.json().get("error") == "Timeout or invalid OTP."
+
+    # =========================================
+    # 10 tries per email in 10 minutes
+    payload = {"email": user_1["test_email"], "otp": wrong}
+    for _ in range(10):
+        response = api_client.post(f"{api_client.base_url}/users/verify-reset-otp/", json=payload)
+        if response.status_code == 429:
+            break
+        assert response.status_code == 400, "Expected status code 400"
+
+    assert response.status_code == 429, "Expected status code 429"
+    assert response.json().get("error") == "Too many requests, please try again later."
 
-    print("=================== Account test passed ==================")
\ No newline at end of file
+    print("=================== Otp attempts test passed ==================")
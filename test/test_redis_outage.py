@@ -0,0 +1,77 @@
+import os
+import sys
+import pytest
+from unittest import mock
+
+# in-process tests against the flask app with fakeredis, no running server needed
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+fakeredis = pytest.importorskip('fakeredis')
+
+from flaskapp import create_app, db, hasher
+from flaskapp.config import Config
+from flaskapp.db_models import User
+from flaskapp.state import RedisClient
+from flaskapp.users.utils import create_access_token
+
+
+class OutageConfig(Config):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    STATE_BACKEND = 'redis'
+    RATELIMIT_ENABLED = False
+    HASH_WORKERS = 0
+    BCRYPT_LOG_ROUNDS = 4
+    HASH_TIME_BUDGET_MS = None
+    METRICS_ENABLED = False
+    REVOCATION_CACHE_TTL = 0
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def app(server):
+    client = fakeredis.FakeStrictRedis(server=server, decode_responses=True)
+    with mock.patch.object(RedisClient, '_create', lambda self, app: client):
+        app = create_app(OutageConfig)
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(username='outage-user', email='outage@example.com', password=hasher.generate_password_hash('Asdf1111')))
+        db.session.commit()
+    return app
+
+
+def auth_header(app):
+    with app.app_context():
+        user = User.get_by_email('outage@example.com')
+        token = create_access_token(user.id)
+    return {"Authorization": f"{app.config['AUTH_PREFIX']} {token}"}
+
+
+# ====================================================================================
+# redis down while a token is checked, protected routes answer 503 instead of 500
+def test_revocation_redis_outage(app, server):
+    client = app.test_client()
+    headers = auth_header(app)
+
+    response = client.get("/api-v1/users/account/", headers=headers)
+    assert response.status_code == 200, "Expected status code 200"
+
+    # =========================================
+    # redis unreachable, the token can't be checked so it is refused
+    server.connected = False
+    response = client.get("/api-v1/users/account/", headers=headers)
+    assert response.status_code == 503, "Expected status code 503"
+    assert response.headers.get("Retry-After") == str(app.config['REVOCATION_RETRY_AFTER'])
+    assert response.get_json().get("error") == "Service unavailable, please try again."
+
+    # log out can't record the revocation either
+    response = client.post("/api-v1/users/log-out/", headers=headers)
+    assert response.status_code == 503, "Expected status code 503"
+
+    # =========================================
+    # redis back, the same token works again
+    server.connected = True
+    response = client.get("/api-v1/users/account/", headers=headers)
+    assert response.status_code == 200, "Expected status code 200"